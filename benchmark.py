@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import click
+import json
+import pathlib
+import platform
+import statistics
+
+import numpy as np
+import pyhf
+
+from helpers import parallel
+from helpers.autotune import backends, installed, optimizers
+from helpers.patchsetIndex import PatchsetIndex
+from helpers.profiler import profiler
+
+import run_patchset
+
+# fixed workloads: simplified patchsets use their first points, full
+# background-only likelihoods get a synthetic signal of a few strengths
+cases = {
+    "1Lbb": ("1Lbb", "simplified_BkgOnly.json", "simplified_patchset.json"),
+    "2L0J": ("2L0J", "simplified_BkgOnly.json", "simplified_patchset.json"),
+    "3Loffshell": ("3Loffshell", "simplified_BkgOnly.json", "simplified_patchset.json"),
+    "sbottom_SRA": ("sbottom", "SRA_BkgOnly.json", None),
+    "sbottom_SRB": ("sbottom", "SRB_BkgOnly.json", None),
+    "sbottom_SRC": ("sbottom", "SRC_BkgOnly.json", None),
+    "directstaus_lowMass": ("directstaus", "lowMass_BkgOnly.json", None),
+    "directstaus_highMass": ("directstaus", "highMass_BkgOnly.json", None),
+    "directstaus_combined": ("directstaus", "combined_BkgOnly.json", None),
+}
+
+signal_fractions = [0.05, 0.1, 0.2, 0.3, 0.5]
+
+
+def synthetic_patch(spec, fraction):
+    """
+    A signal sample in every channel with ``fraction`` of the total background
+    as nominal yield, scaled by the POI of the first measurement.
+    """
+    poi = spec["measurements"][0]["config"]["poi"]
+    ops = []
+    for index, channel in enumerate(spec["channels"]):
+        background = np.sum([sample["data"] for sample in channel["samples"]], axis=0)
+        ops.append(
+            {
+                "op": "add",
+                "path": f"/channels/{index}/samples/-",
+                "value": {
+                    "name": "benchmark_signal",
+                    "data": (fraction * background).tolist(),
+                    "modifiers": [{"name": poi, "type": "normfactor", "data": None}],
+                },
+            }
+        )
+    return pyhf.patchset.Patch(
+        {
+            "metadata": {"name": f"signal_{fraction}", "values": [fraction]},
+            "patch": ops,
+        }
+    )
+
+
+def load_case(name, n_points):
+    group, likelihood, patchset = cases[name]
+    directory = pathlib.Path(f"./analyses/{group}/likelihoods")
+    spec = json.load(open(directory / likelihood, "r"))
+    if patchset:
+        index = PatchsetIndex(directory / patchset)
+        entries = [entry for entry in index.entries if entry.n_ops][:n_points]
+        patches = [index.load(entry) for entry in entries]
+    else:
+        patches = [
+            synthetic_patch(spec, fraction) for fraction in signal_fractions[:n_points]
+        ]
+    return spec, patches
+
+
+def run_case(spec, patches, repeat):
+    """
+    Time building the model and running the hypotest for every point, after
+    one untimed warm-up point. Returns the per-point times of all repeats.
+    """
+    parallel.shared.update(inplace=True, verify=False)
+    run_patchset.run_single_point(spec, patches[0])
+
+    times = []
+    for _ in range(repeat):
+        for patch in patches:
+            with profiler.point(patch.name) as record:
+                run_patchset.run_single_point(spec, patch)
+            times.append(record["total"])
+    return times
+
+
+def machine_name():
+    return platform.node() or "unknown"
+
+
+@click.command()
+@click.option(
+    "--case",
+    "selected",
+    multiple=True,
+    type=click.Choice(list(cases)),
+    help="Cases to run, defaults to all",
+)
+@click.option("--backend", "selected_backends", multiple=True, default=backends)
+@click.option("--optimizer", "selected_optimizers", multiple=True, default=optimizers)
+@click.option("--points", default=5, type=click.IntRange(min=1))
+@click.option("--repeat", default=3, type=click.IntRange(min=1))
+@click.option("--machine", default=None, help="Name of the baseline to compare to")
+@click.option(
+    "--baseline-dir",
+    default="benchmarks",
+    type=click.Path(file_okay=False),
+)
+@click.option(
+    "--save-baseline/--no-save-baseline",
+    default=False,
+    help="Store the measured timings as the new baseline of this machine",
+)
+@click.option(
+    "--threshold",
+    default=0.1,
+    help="Relative slowdown w.r.t. the baseline that counts as a regression",
+)
+@click.option("--output", default=None, type=click.Path(dir_okay=False))
+def main(
+    selected,
+    selected_backends,
+    selected_optimizers,
+    points,
+    repeat,
+    machine,
+    baseline_dir,
+    save_baseline,
+    threshold,
+    output,
+):
+    """
+    Time fixed subsets of the bundled likelihoods for every installed backend
+    and optimizer, and compare them to the stored baseline of this machine.
+    """
+    machine = machine or machine_name()
+    baseline_path = pathlib.Path(baseline_dir) / f"{machine}.json"
+    baseline = (
+        json.load(open(baseline_path, "r"))["results"] if baseline_path.exists() else {}
+    )
+
+    combinations = installed(selected_backends, selected_optimizers)
+    click.echo(
+        f"Machine {machine}, running {', '.join(f'{b}/{o}' for b, o in combinations)}"
+    )
+
+    results = {}
+    regressions = []
+    for name in selected or cases:
+        spec, patches = load_case(name, points)
+        for backend, optimizer in combinations:
+            pyhf.set_backend(backend, optimizer)
+            key = f"{name}/{backend}/{optimizer}"
+            try:
+                times = run_case(spec, patches, repeat)
+            except Exception as error:
+                click.echo(f"{key:<40} failed: {error}", err=True)
+                continue
+
+            results[key] = {
+                "median": statistics.median(times),
+                "min": min(times),
+                "points": len(patches),
+                "repeat": repeat,
+            }
+            line = f"{key:<40} median={results[key]['median']:.4f}s min={results[key]['min']:.4f}s"
+            if key in baseline:
+                change = results[key]["median"] / baseline[key]["median"] - 1
+                line += f" ({change:+.1%} w.r.t. baseline)"
+                if change > threshold:
+                    line += " REGRESSION"
+                    regressions.append(key)
+            click.echo(line)
+
+    if output:
+        with open(output, "w") as output_file:
+            json.dump({"machine": machine, "results": results}, output_file, indent=2)
+
+    if save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(
+                {
+                    "machine": machine,
+                    "platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "python": platform.python_version(),
+                    "pyhf": pyhf.__version__,
+                    "results": {**baseline, **results},
+                },
+                baseline_file,
+                indent=2,
+                sort_keys=True,
+            )
+        click.echo(f"Baseline written to {baseline_path}")
+
+    if regressions:
+        click.echo(
+            f"{len(regressions)} regression(s) beyond {threshold:.0%}: {' '.join(regressions)}",
+            err=True,
+        )
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
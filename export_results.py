@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import click
+import fnmatch
+import pathlib
+
+from helpers.resultStore import ResultStore, store_path
+
+
+@click.command()
+@click.option(
+    "--group",
+    default="1Lbb",
+    type=click.Choice(
+        [
+            "1Lbb",
+            "2L0J",
+            "compressed",
+            "3Loffshell",
+            "stop1L",
+            "3LRJR",
+            "directstaus",
+            "samesign",
+            "sbottom",
+        ]
+    ),
+)
+@click.option("--include", default="*", help="Only export results matching this")
+@click.option(
+    "--output-dir",
+    default=None,
+    help="Where to write the result files, defaults to the results directory of the group",
+)
+def main(group, include, output_dir):
+    """
+    Export the results store of a group into the legacy per-point result files.
+    """
+    store = ResultStore(store_path(group))
+    names = [
+        record["name"]
+        for record in store
+        if fnmatch.fnmatch(f"{record['name']}.json", include)
+    ]
+    output_dir = output_dir or pathlib.Path(f"analyses/{group}/results")
+    written = store.export(output_dir, names=set(names))
+    click.echo(f"Exported {len(written)} result(s) to {output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 #!/usr/bin/env python
 
+import fnmatch
 import json
+import os
 import re
 import click
 import pathlib
 
+from helpers.resultStore import ResultStore, store_path
+
 
 def string_to_float(string):
     return float(string.replace("p", "."))
@@ -14,15 +18,28 @@ pattern = re.compile("(\d+(?:p[05])?)_(\d+(?:p[05])?)")
 
 
 def filename_to_mass(filename):
+    return name_to_mass(filename.name)
+
+
+def name_to_mass(name):
     global pattern
-    match = pattern.search(filename.name)
+    match = pattern.search(name)
     assert match
     return string_to_float(match.group(1)), string_to_float(match.group(2))
 
 
+def upper_limit(result, index=None):
+    # -1 if no upper limit was computed or it is above the range of mu
+    if index is None:
+        limit = result.get("UL_obs")
+    else:
+        limit = result.get("UL_exp", [None] * 5)[index]
+    return -1 if limit is None else limit
+
+
 def make_harvest_from_result(result, masses):
-    return {
-        "CLs": result["CLs_obs"],
+    harvest = {
+        "CLs": result.get("CLs_obs"),
         "CLsexp": result["CLs_exp"][2],
         "clsd1s": result["CLs_exp"][1],
         "clsd2s": result["CLs_exp"][0],
@@ -31,11 +48,11 @@ def make_harvest_from_result(result, masses):
         "covqual": 3,
         "dodgycov": 0,
         "excludedXsec": -999007,
-        "expectedUpperLimit": -1,
-        "expectedUpperLimitMinus1Sig": -1,
-        "expectedUpperLimitMinus2Sig": -1,
-        "expectedUpperLimitPlus1Sig": -1,
-        "expectedUpperLimitPlus2Sig": -1,
+        "expectedUpperLimit": upper_limit(result, 2),
+        "expectedUpperLimitMinus1Sig": upper_limit(result, 1),
+        "expectedUpperLimitMinus2Sig": upper_limit(result, 0),
+        "expectedUpperLimitPlus1Sig": upper_limit(result, 3),
+        "expectedUpperLimitPlus2Sig": upper_limit(result, 4),
         "fID": -1,
         "failedcov": 0,
         "failedfit": 0,
@@ -47,7 +64,7 @@ def make_harvest_from_result(result, masses):
         "dm": masses[0] - masses[1],
         "mode": -1,
         "nexp": -1,
-        "nofit": 0,
+        "nofit": int(result.get("bounded", False)),
         "p0": 0,
         "p0d1s": -1,
         "p0d2s": -1,
@@ -58,10 +75,58 @@ def make_harvest_from_result(result, masses):
         "seed": 0,
         "sigma0": -1,
         "sigma1": -1,
-        "upperLimit": -1,
+        "upperLimit": upper_limit(result),
         "upperLimitEstimatedError": -1,
         "xsec": -999007,
     }
+    if "CLs_obs" not in result:
+        # expected-only result, the observed fields are left out
+        del harvest["CLs"], harvest["upperLimit"]
+    return harvest
+
+
+def harvest_wildcard(include, simplified):
+    wildcard = "*.json" if not include else include
+    return f"{'simplified_' if simplified else ''}{wildcard}"
+
+
+def matching_records(records, wildcard):
+    # records are matched as if they were the legacy per-point files
+    return [
+        record
+        for record in records
+        if fnmatch.fnmatch(f"{record['name']}.json", wildcard)
+    ]
+
+
+def harvest_records(records):
+    return [
+        make_harvest_from_result(record, name_to_mass(record["name"]))
+        for record in records
+    ]
+
+
+def harvest_path(group, simplified, suffix=""):
+    return pathlib.Path(
+        f"./analyses/{group}/harvests/harvest_{'simplified_' if simplified else ''}{group}{suffix}.json"
+    )
+
+
+def write_harvest(harvest, path):
+    """
+    Write a harvest file, replacing an existing one only once it is complete.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.partial")
+    with partial.open("w") as output_file:
+        json.dump(
+            harvest,
+            output_file,
+            sort_keys=True,
+            indent=2,
+        )
+    os.replace(partial, path)
 
 
 @click.command()
@@ -86,26 +151,25 @@ def main(group, include, simplified):
 
     match_base = group
 
-    wildcard = "*.json" if not include else include
-    filenames = pathlib.Path(f"./analyses/{group}/results/").glob(
-        f"{'simplified_' if simplified else ''}{wildcard}"
-    )
-
-    for filename in filenames:
-        print(filename)
-        result = json.load(filename.open())
-        masses = filename_to_mass(filename)
-        harvest.append(make_harvest_from_result(result, masses))
-
-    with pathlib.Path(
-        f"./analyses/{group}/harvests/harvest_{'simplified_' if simplified else ''}{group}.json"
-    ).open("w+") as output_file:
-        json.dump(
-            harvest,
-            output_file,
-            sort_keys=True,
-            indent=2,
-        )
+    wildcard = harvest_wildcard(include, simplified)
+
+    store = ResultStore(store_path(group))
+    if len(store):
+        for record in matching_records(store, wildcard):
+            print(record["name"])
+            harvest.append(
+                make_harvest_from_result(record, name_to_mass(record["name"]))
+            )
+    else:
+        filenames = pathlib.Path(f"./analyses/{group}/results/").glob(wildcard)
+
+        for filename in filenames:
+            print(filename)
+            result = json.load(filename.open())
+            masses = filename_to_mass(filename)
+            harvest.append(make_harvest_from_result(result, masses))
+
+    write_harvest(harvest, harvest_path(group, simplified))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import pathlib
+import statistics
+from time import perf_counter
+
+import pyhf
+
+from helpers.resultStore import append_record, read_records
+
+# numpy/scipy first, it is the reference the other combinations are checked against
+backends = ["numpy", "pytorch", "tensorflow", "jax"]
+optimizers = ["scipy", "minuit"]
+
+
+def installed(backends, optimizers):
+    combinations = []
+    for backend in backends:
+        for optimizer in optimizers:
+            try:
+                pyhf.set_backend(backend, optimizer)
+            except Exception:
+                continue
+            combinations.append((backend, optimizer))
+    return combinations
+
+
+def tune(evaluate, points, candidates, tolerance=1e-3):
+    """
+    Time ``evaluate(point)`` on all ``points`` with every (backend, optimizer)
+    of ``candidates`` and pick the fastest whose CLs values stay within
+    ``tolerance`` of those of the first candidate that works. ``evaluate``
+    returns the CLs values of a point as a flat list. The first point is run
+    once more beforehand, untimed, to leave out imports and compilation.
+
+    Returns:
+        Tuple of the chosen (backend, optimizer) and the timings, differences
+        or errors of all candidates.
+    """
+    evidence = {}
+    reference = None
+    for backend, optimizer in candidates:
+        label = f"{backend}/{optimizer}"
+        pyhf.set_backend(backend, optimizer)
+        try:
+            evaluate(points[0])
+            times, values = [], []
+            for point in points:
+                start = perf_counter()
+                values.append(evaluate(point))
+                times.append(perf_counter() - start)
+        except Exception as error:
+            evidence[label] = {"error": f"{type(error).__name__}: {error}"}
+            continue
+        if reference is None:
+            reference = values
+        difference = max(
+            abs(float(a) - float(b))
+            for point_values, reference_values in zip(values, reference)
+            for a, b in zip(point_values, reference_values)
+        )
+        evidence[label] = {
+            "backend": backend,
+            "optimizer": optimizer,
+            "seconds": statistics.median(times),
+            "difference": difference,
+        }
+
+    consistent = [
+        entry
+        for entry in evidence.values()
+        if "seconds" in entry and entry["difference"] <= tolerance
+    ]
+    if not consistent:
+        raise RuntimeError(f"No backend could run the tuning points: {evidence}")
+    fastest = min(consistent, key=lambda entry: entry["seconds"])
+    return (fastest["backend"], fastest["optimizer"]), evidence
+
+
+def load_tuning(path, key):
+    """
+    The latest (backend, optimizer) stored for ``key``, or None.
+    """
+    choice = None
+    for record in read_records(path):
+        if record["key"] == key:
+            choice = (record["backend"], record["optimizer"])
+    return choice
+
+
+def store_tuning(path, key, choice, evidence):
+    backend, optimizer = choice
+    append_record(
+        path,
+        {"key": key, "backend": backend, "optimizer": optimizer, "evidence": evidence},
+    )
+
+
+def auto_backend(path, likelihood, evaluate, points, optimizer=None):
+    """
+    The (backend, optimizer) stored in ``path`` for the likelihood digest
+    ``likelihood``, or tuned on ``points`` and stored. ``optimizer`` restricts
+    the candidates to a single optimizer.
+    """
+    key = pyhf.utils.digest({"likelihood": likelihood, "optimizer": optimizer})
+    choice = load_tuning(path, key)
+    if choice is not None:
+        print(f"Using {choice[0]}/{choice[1]}, tuned in an earlier run.")
+        return choice
+
+    candidates = installed(backends, [optimizer] if optimizer else optimizers)
+    choice, evidence = tune(evaluate, points, candidates)
+    for label, entry in evidence.items():
+        if "error" in entry:
+            print(f"  {label:<18} failed: {entry['error']}")
+        else:
+            print(
+                f"  {label:<18} {entry['seconds']:.4f}s per point, CLs difference {entry['difference']:.2g}"
+            )
+    print(f"Using {choice[0]}/{choice[1]}.")
+    store_tuning(path, key, choice, evidence)
+    return choice
+
+
+def tuning_path(group):
+    return pathlib.Path(f"analyses/{group}/cache/autotune.jsonl")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+import math
+
+import numpy as np
+
+# columns of all_cls_values that define the contours: the observed and the
+# nominal expected CLs, and with the band also the expected CLs at +-1 sigma
+contour_columns = [0, 3]
+band_columns = [0, 2, 3, 4]
+
+
+def all_cls_values(result):
+    """
+    Observed CLs followed by the expected CLs band (+2 to -2 sigma).
+    """
+    # nan for expected-only results, which never compares as near the contour
+    return [result.get("CLs_obs", math.nan), *result["CLs_exp"]]
+
+
+def cls_values(result, bands=False):
+    """
+    The CLs values whose contours are drawn, see ``contour_columns``.
+    """
+    values = all_cls_values(result)
+    return [values[column] for column in (band_columns if bands else contour_columns)]
+
+
+class BoundaryScheduler:
+    """
+    Run order of a scan that only fits the points near the CLs contour.
+
+    A coarse subset of points, spread evenly over the (normalized) signal point
+    ``values``, is fitted first. After that, every round fits the remaining
+    points whose nearest fitted neighbours straddle ``level`` in the observed
+    or nominal expected CLs (and the expected CLs at +-1 sigma if ``bands``),
+    until no such point is left. With ``margin`` above 1, neighbours within
+    that factor of ``level`` count as straddling it. All other points get
+    bounded results from their neighbours, see ``bounded``.
+
+    Results of points fitted earlier (e.g. cached ones) can be passed as
+    ``known``, a list of (entry, result) tuples, and are used as neighbours.
+    """
+
+    def __init__(
+        self,
+        entries,
+        known=(),
+        coarse_fraction=0.25,
+        neighbours=4,
+        level=0.05,
+        margin=1.0,
+        bands=False,
+    ):
+        self.entries = list(entries)
+        self.coarse_fraction = coarse_fraction
+        self.neighbours = neighbours
+        self.level = level
+        self.margin = margin
+        self.columns = band_columns if bands else contour_columns
+
+        known = list(known)
+        values = np.asarray(
+            [entry.values for entry in self.entries]
+            + [entry.values for entry, _ in known],
+            dtype=float,
+        ).reshape(len(self.entries) + len(known), -1)
+        low, high = values.min(axis=0), values.max(axis=0)
+        values = (values - low) / np.where(high > low, high - low, 1.0)
+        self.values = values[: len(self.entries)]
+
+        self.fitted_values = list(values[len(self.entries) :])
+        self.fitted_cls = [all_cls_values(result) for _, result in known]
+        self.index = {entry.name: i for i, entry in enumerate(self.entries)}
+        self.scheduled = set()
+
+    def add(self, entry, result):
+        self.fitted_values.append(self.values[self.index[entry.name]])
+        self.fitted_cls.append(all_cls_values(result))
+
+    def _coarse(self):
+        """
+        Farthest-point sampling of the points, starting from the known ones.
+        """
+        total = len(self.entries) + len(self.fitted_values)
+        n_coarse = min(
+            math.ceil(self.coarse_fraction * total) - len(self.fitted_values),
+            len(self.entries),
+        )
+        if n_coarse <= 0:
+            return []
+        if self.fitted_values:
+            distances = self._distances(np.arange(len(self.entries))).min(axis=1)
+        else:
+            # without any known point, start from the first one
+            distances = np.full(len(self.entries), np.inf)
+        selected = []
+        for _ in range(n_coarse):
+            index = int(np.argmax(distances))
+            selected.append(index)
+            distances = np.minimum(
+                distances, np.linalg.norm(self.values - self.values[index], axis=1)
+            )
+            distances[index] = -1.0
+        return selected
+
+    def _distances(self, indices):
+        return np.linalg.norm(
+            self.values[indices, None, :] - np.asarray(self.fitted_values)[None],
+            axis=2,
+        )
+
+    def _neighbour_cls(self, indices):
+        """
+        CLs values of the nearest fitted neighbours of each point, shape
+        (n_points, neighbours, 6).
+        """
+        distances = self._distances(indices)
+        k = min(self.neighbours, distances.shape[1])
+        nearest = np.argsort(distances, axis=1)[:, :k]
+        return np.asarray(self.fitted_cls, dtype=float)[nearest]
+
+    def _near_contour(self, indices):
+        neighbour_cls = self._neighbour_cls(indices)[..., self.columns]
+        low, high = neighbour_cls.min(axis=1), neighbour_cls.max(axis=1)
+        near = (low < self.level * self.margin) & (high > self.level / self.margin)
+        return near.any(axis=1)
+
+    def rounds(self):
+        """
+        Yield the lists of entries to fit, one round at a time. The results of
+        a round have to be passed to ``add`` before the next one is requested.
+        """
+        batch = self._coarse()
+        while True:
+            if batch:
+                self.scheduled.update(batch)
+                yield [self.entries[index] for index in batch]
+            pending = self.pending()
+            if not pending or not self.fitted_values:
+                return
+            batch = [
+                index
+                for index, near in zip(pending, self._near_contour(pending))
+                if near
+            ]
+            if not batch:
+                return
+
+    def pending(self):
+        return [
+            index for index in range(len(self.entries)) if index not in self.scheduled
+        ]
+
+    def bounded(self):
+        """
+        Results for all points that were not fitted. Where all neighbours are
+        on the same side of ``level``, their value closest to it is taken, i.e.
+        a CLs bound on that side. The results are marked with ``bounded``.
+        Values that are not checked for the contour (the expected CLs at +-2
+        sigma, and at +-1 sigma without ``bands``) may still straddle
+        ``level``, these take the smallest value of the neighbours.
+        """
+        pending = self.pending()
+        if not pending or not self.fitted_values:
+            return []
+        neighbour_cls = self._neighbour_cls(pending)
+        excluded = neighbour_cls.max(axis=1) < self.level
+        bound = np.where(excluded, neighbour_cls.max(axis=1), neighbour_cls.min(axis=1))
+        results = []
+        for index, values in zip(pending, bound):
+            result = {"CLs_exp": values[1:].tolist(), "bounded": True}
+            if not np.isnan(values[0]):
+                result["CLs_obs"] = float(values[0])
+            results.append((self.entries[index], result))
+        return results
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+import numpy as np
+import scipy.interpolate
+
+from helpers.profiler import stage
+from helpers.resultCache import curve_result, limit_result
+from helpers.upperLimit import upper_limits
+
+# default range and number of the signal strengths of the stored curves, i.e.
+# of the signal scale factors they cover
+curve_range = (0.1, 10.0)
+curve_points = 25
+
+
+def curve_grid(low=curve_range[0], high=curve_range[1], n_points=curve_points):
+    """
+    ``n_points`` log-spaced signal strengths from ``low`` to ``high``.
+    """
+    return np.geomspace(low, high, n_points)
+
+
+def cls_curves(evaluate, n_points, mu_max, grid=None):
+    """
+    Observed and expected CLs of ``n_points`` points at the signal strengths
+    of ``grid`` (up to ``mu_max``, by default ``curve_grid()``), evaluated by
+    a single call of ``evaluate(points, mus)`` as in ``helpers.upperLimit``.
+
+    Returns:
+        List of curves, dicts with the signal strengths ``mu`` and the CLs
+        values ``CLs_obs`` (left out if ``evaluate`` returns None as the
+        observed CLs) and ``CLs_exp`` (five values per signal strength).
+    """
+    grid = curve_grid() if grid is None else np.asarray(grid, dtype=float)
+    mus = grid[grid <= mu_max]
+    obsCLs, expCLs = evaluate(
+        np.repeat(np.arange(n_points), len(mus)), np.tile(mus, n_points)
+    )
+    curves = []
+    for point in range(n_points):
+        values = slice(point * len(mus), (point + 1) * len(mus))
+        curve = {
+            "mu": mus.tolist(),
+            "CLs_exp": np.column_stack([band[values] for band in expCLs]).tolist(),
+        }
+        if obsCLs is not None:
+            curve["CLs_obs"] = np.asarray(obsCLs[values], dtype=float).tolist()
+        curves.append(curve)
+    return curves
+
+
+def interpolate_cls(mus, cls, mu):
+    """
+    CLs at ``mu``, from a cubic spline of log(CLs) in log(mu), on which CLs
+    curves are close to straight lines. None outside of the range of ``mus``.
+    """
+    if not mus[0] <= mu <= mus[-1]:
+        return None
+    if len(mus) == 1:
+        return float(cls[0])
+    log_cls = np.log(np.maximum(cls, np.finfo(float).tiny))
+    return float(
+        np.exp(scipy.interpolate.CubicSpline(np.log(mus), log_cls)(np.log(mu)))
+    )
+
+
+def rescale_result(result, scale):
+    """
+    The result of a point whose signal is scaled by ``scale`` (e.g. a
+    different cross-section), from its stored curve: as the signal only
+    enters through its signal strength, this is the result at mu = ``scale``,
+    and upper limits on mu shrink by ``scale``.
+    """
+    curve = result.get("curve")
+    if curve is None:
+        raise ValueError("Result has no CLs curve")
+    mus = curve["mu"]
+    if not mus[0] <= scale <= mus[-1]:
+        raise ValueError(
+            f"Scale factor {scale} is outside of the curve ({mus[0]:.3g} to {mus[-1]:.3g})"
+        )
+
+    rescaled = {key: value for key, value in result.items() if key != "curve"}
+    rescaled["CLs_exp"] = [
+        interpolate_cls(mus, band, scale) for band in np.transpose(curve["CLs_exp"])
+    ]
+    if "CLs_obs" in curve:
+        rescaled["CLs_obs"] = interpolate_cls(mus, curve["CLs_obs"], scale)
+    if rescaled.get("UL_obs") is not None:
+        rescaled["UL_obs"] = result["UL_obs"] / scale
+    if "UL_exp" in rescaled:
+        rescaled["UL_exp"] = [
+            None if limit is None else limit / scale for limit in result["UL_exp"]
+        ]
+    return rescaled
+
+
+def signal_scans(
+    evaluate, n_points, mu_max, limits=False, curves=False, observed=True, grid=None
+):
+    """
+    Extra result fields of ``n_points`` points from scans of their signal
+    strength, the upper limits on mu if ``limits`` and the CLs curves at the
+    signal strengths of ``grid`` if ``curves``.
+    """
+    extras = [{} for _ in range(n_points)]
+    if limits:
+        with stage("upper_limit"):
+            for extra, point_limits in zip(
+                extras, upper_limits(evaluate, n_points, mu_max)
+            ):
+                extra.update(limit_result(*point_limits, observed=observed))
+    if curves:
+        with stage("cls_curve"):
+            for extra, curve in zip(
+                extras, cls_curves(evaluate, n_points, mu_max, grid)
+            ):
+                extra.update(curve_result(curve))
+    return extras
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import pathlib
+
+import numpy as np
+
+from helpers.resultStore import append_record, read_records
+
+
+def model_size(spec):
+    """
+    Rough cost of fitting a workspace spec, the number of (bins + modifiers)
+    times the number of parameters, as every evaluation of the likelihood runs
+    over all bins and modifiers, and the number of evaluations per fit grows
+    with the number of parameters.
+    """
+    bins = 0
+    modifiers = 0
+    parameters = set()
+    for channel in spec["channels"]:
+        for sample in channel["samples"]:
+            bins += len(sample["data"])
+            modifiers += len(sample["modifiers"])
+            parameters.update(modifier["name"] for modifier in sample["modifiers"])
+    return (bins + modifiers) * max(1, len(parameters))
+
+
+class CostModel:
+    """
+    Estimated run time of points, used to dispatch the most expensive ones
+    first so that the tail of a parallel scan does not wait on a slow point.
+
+    The time of every completed point is appended to ``path`` together with
+    its size (e.g. from ``model_size``). Points that ran before are estimated
+    by their latest time, all others by their size times the median time per
+    unit of size of the known points.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.timings = {record["name"]: record for record in read_records(self.path)}
+        ratios = [
+            record["seconds"] / record["size"]
+            for record in self.timings.values()
+            if record["size"] > 0
+        ]
+        self.scale = float(np.median(ratios)) if ratios else 1.0
+
+    def __len__(self):
+        return len(self.timings)
+
+    def estimate(self, name, size):
+        record = self.timings.get(name)
+        if record is not None:
+            return record["seconds"]
+        return size * self.scale
+
+    def add(self, name, seconds, size):
+        record = {"name": name, "seconds": seconds, "size": size}
+        self.timings[name] = record
+        append_record(self.path, record)
+
+
+def timings_path(group):
+    return pathlib.Path(f"analyses/{group}/cache/timings.jsonl")
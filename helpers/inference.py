@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+
+import numpy as np
+import scipy.stats
+
+import pyhf
+
+# order of the expected CLs band, matching pyhf.infer.hypotest(return_expected_set=True)
+expected_sigmas = [2, 1, 0, -1, -2]
+
+
+def asymptotic_cls(qmu, qmu_A, qtilde=True):
+    """
+    Observed CLs and expected CLs band from the (arrays of) observed and Asimov
+    test statistics, following pyhf.infer.calculators.AsymptoticCalculator.
+    The observed CLs is None if ``qmu`` is None.
+    """
+    norm = scipy.stats.norm
+    sqrtqmu_A = np.sqrt(qmu_A)
+    expCLs = [
+        norm.cdf(-(n_sigma + sqrtqmu_A)) / norm.cdf(-n_sigma)
+        for n_sigma in expected_sigmas
+    ]
+    if qmu is None:
+        return None, expCLs
+
+    sqrtqmu = np.sqrt(qmu)
+    if qtilde:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            teststat = np.where(
+                sqrtqmu < sqrtqmu_A,
+                sqrtqmu - sqrtqmu_A,
+                (qmu - qmu_A) / (2 * sqrtqmu_A),
+            )
+    else:
+        teststat = sqrtqmu - sqrtqmu_A
+
+    obsCLs = norm.cdf(-(teststat + sqrtqmu_A)) / norm.cdf(-teststat)
+    return obsCLs, expCLs
+
+
+def point_results(obsCLs, expCLs, n_points):
+    """
+    Split batched CLs values into (observed CLs, expected CLs band) per point,
+    the observed CLs is None for expected-only results.
+    """
+    return [
+        (None if obsCLs is None else obsCLs[i], [CLs[i] for CLs in expCLs])
+        for i in range(n_points)
+    ]
+
+
+def batched_twice_nll(pars, data, pdf):
+    tensorlib, _ = pyhf.get_backend()
+    nll = -2 * np.asarray(
+        tensorlib.tolist(
+            pdf.logpdf(tensorlib.astensor(pars), tensorlib.astensor(data))
+        ),
+        dtype=float,
+    )
+    # unphysical (negative) rates give nan, keep the optimizer away from them
+    return np.where(np.isfinite(nll), nll, 1e10)
+
+
+def batched_derivatives(pars, nll, data, pdf, par_bounds, free):
+    """
+    Central finite-difference gradient and diagonal curvature of twice the NLL
+    in every batch slot. The slots share no parameters, so each parameter is
+    varied in all slots at once.
+    """
+    lo, hi = par_bounds[..., 0], par_bounds[..., 1]
+    step = 1e-5 * np.maximum(1.0, hi - lo)
+    grad = np.zeros(pars.shape)
+    curvature = np.ones(pars.shape)
+    for index in np.flatnonzero(free):
+        up, down = pars.copy(), pars.copy()
+        up[:, index] = np.minimum(pars[:, index] + step[:, index], hi[:, index])
+        down[:, index] = np.maximum(pars[:, index] - step[:, index], lo[:, index])
+        h_up = up[:, index] - pars[:, index]
+        h_down = pars[:, index] - down[:, index]
+        nll_up = batched_twice_nll(up, data, pdf)
+        nll_down = batched_twice_nll(down, data, pdf)
+        width = np.where(h_up + h_down > 0, h_up + h_down, 1.0)
+        grad[:, index] = (nll_up - nll_down) / width
+        # one-sided steps at a bound still give a usable second derivative
+        slope_up = (nll_up - nll) / np.where(h_up > 0, h_up, 1.0)
+        slope_down = (nll - nll_down) / np.where(h_down > 0, h_down, 1.0)
+        both = (h_up > 0) & (h_down > 0)
+        curvature[:, index] = np.where(both, 2 * (slope_up - slope_down) / width, 1.0)
+    return grad, np.where(curvature > 1e-8, curvature, 1.0)
+
+
+def batched_fit(data, pdf, init_pars, par_bounds, maxiter=1000, tolerance=1e-4):
+    """
+    Minimize twice the NLL independently in every batch slot of a batched model.
+
+    Every slot runs its own projected quasi-Newton (BFGS) minimization with its
+    own line search, but all objective evaluations are batched. Parameters with
+    equal lower and upper bound are held fixed.
+
+    Args:
+        data: observed data, shape (batch_size, ndata)
+        init_pars: initial parameters, shape (batch_size, npars)
+        par_bounds: parameter bounds, shape (batch_size, npars, 2)
+
+    Returns:
+        Tuple of the best-fit parameters and the minimized objective per slot.
+    """
+    par_bounds = np.asarray(par_bounds, dtype=float)
+    lo, hi = par_bounds[..., 0], par_bounds[..., 1]
+    pars = np.clip(np.asarray(init_pars, dtype=float), lo, hi)
+    batch_size, npars = pars.shape
+    free = lo < hi
+    varied = free.any(axis=0)
+
+    nll = batched_twice_nll(pars, data, pdf)
+    grad, curvature = batched_derivatives(pars, nll, data, pdf, par_bounds, varied)
+    inv_hessian = np.zeros((batch_size, npars, npars))
+    blocked = np.zeros((batch_size, npars), dtype=bool)
+    reset = np.ones(batch_size, dtype=bool)
+    active = np.ones(batch_size, dtype=bool)
+
+    for _ in range(maxiter):
+        # parameters sitting at a bound and pushed outwards are frozen, the
+        # quasi-Newton approximation restarts whenever that set changes
+        was_blocked = blocked
+        blocked = ~free | ((pars <= lo) & (grad > 0)) | ((pars >= hi) & (grad < 0))
+        projected = np.where(blocked, 0.0, grad)
+        active &= np.abs(projected).max(axis=1) > tolerance
+        if not active.any():
+            break
+
+        reset |= (blocked != was_blocked).any(axis=1)
+        direction = -np.einsum("bij,bj->bi", inv_hessian, projected)
+        reset |= np.einsum("bi,bi->b", direction, projected) >= 0
+        if reset.any():
+            inv_hessian[reset] = np.einsum(
+                "bi,ij->bij", 1.0 / curvature[reset], np.eye(npars)
+            )
+            direction[reset] = -projected[reset] / curvature[reset]
+            reset[:] = False
+        direction[blocked] = 0.0
+
+        # backtracking line search in every slot, with projection onto the bounds
+        step_size = np.ones(batch_size)
+        pending = active.copy()
+        new_pars, new_nll = pars.copy(), nll.copy()
+        for _ in range(40):
+            trial = np.clip(pars + step_size[:, None] * direction, lo, hi)
+            trial_nll = batched_twice_nll(trial, data, pdf)
+            decrease = np.einsum("bi,bi->b", grad, trial - pars)
+            accept = pending & (trial_nll <= nll + 1e-4 * decrease)
+            new_pars[accept], new_nll[accept] = trial[accept], trial_nll[accept]
+            pending &= ~accept
+            if not pending.any():
+                break
+            step_size[pending] *= 0.5
+        # slots without any improvement have converged
+        active &= ~pending
+
+        new_grad, curvature = batched_derivatives(
+            new_pars, new_nll, data, pdf, par_bounds, varied
+        )
+        s = np.where(blocked, 0.0, new_pars - pars)
+        y = np.where(blocked, 0.0, new_grad - grad)
+        sy = np.einsum("bi,bi->b", s, y)
+        update = active & (sy > 1e-12)
+        if update.any():
+            rho = 1.0 / sy[update]
+            left = np.eye(npars) - rho[:, None, None] * np.einsum(
+                "bi,bj->bij", s[update], y[update]
+            )
+            inv_hessian[update] = np.einsum(
+                "bij,bjk,blk->bil", left, inv_hessian[update], left
+            ) + rho[:, None, None] * np.einsum("bi,bj->bij", s[update], s[update])
+
+        converged = np.abs(nll - new_nll) < 1e-9
+        pars, nll, grad = new_pars, new_nll, new_grad
+        active &= ~converged
+
+    return pars, nll
+
+
+def _batched_qmu(mu, data, pdf, init_pars, par_bounds, poi_index, minimum=None):
+    fixed_bounds = par_bounds.copy()
+    fixed_bounds[:, poi_index] = mu[:, None]
+    fixed_init = init_pars.copy()
+    fixed_init[:, poi_index] = mu
+    _, fixed_nll = batched_fit(data, pdf, fixed_init, fixed_bounds)
+    if minimum is None:
+        free_pars, free_nll = batched_fit(data, pdf, init_pars, par_bounds)
+    else:
+        free_pars, free_nll = minimum, batched_twice_nll(minimum, data, pdf)
+    qmu = np.clip(fixed_nll - free_nll, 0.0, None)
+    return np.where(free_pars[:, poi_index] > mu, 0.0, qmu)
+
+
+def _batched_setup(data, pdf):
+    """
+    Data, initial parameters and bounds per batch slot. Fixed parameters are
+    fixed through their bounds.
+    """
+    batch_size = pdf.batch_size
+    data = np.tile(np.asarray(data, dtype=float), (batch_size, 1))
+    init_pars = np.tile(pdf.config.suggested_init(), (batch_size, 1)).astype(float)
+    par_bounds = np.tile(
+        np.asarray(pdf.config.suggested_bounds(), dtype=float), (batch_size, 1, 1)
+    )
+    for index, is_fixed in enumerate(pdf.config.suggested_fixed()):
+        if is_fixed:
+            par_bounds[:, index] = init_pars[:, index, None]
+    return data, init_pars, par_bounds
+
+
+def batched_background_fit(data, pdf, init_pars, par_bounds):
+    """
+    Conditional fits at mu=0 in every batch slot, i.e. the parameters of the
+    background-only Asimov dataset of every slot.
+    """
+    poi_index = pdf.config.poi_index
+    asimov_bounds = par_bounds.copy()
+    asimov_bounds[:, poi_index] = 0.0
+    asimov_init = init_pars.copy()
+    asimov_init[:, poi_index] = 0.0
+    asimov_pars, _ = batched_fit(data, pdf, asimov_init, asimov_bounds)
+    return asimov_pars
+
+
+def shared_background_fit(data, pdf):
+    """
+    Conditional fit at mu=0 of a batched model whose slots only differ in the
+    signal, as a dict of parameter name to values.
+    """
+    data, init_pars, par_bounds = _batched_setup(data, pdf)
+    return pars_by_name(
+        pdf, batched_background_fit(data, pdf, init_pars, par_bounds)[0]
+    )
+
+
+def batched_reference_fits(data, pdf, asimov_pars=None, expected_only=False):
+    """
+    Unconditional fit and conditional fit at mu=0 in every batch slot, which do
+    not depend on the tested signal strength. The former is skipped (None)
+    with ``expected_only``, the latter if ``asimov_pars`` is given.
+    """
+    data, init_pars, par_bounds = _batched_setup(data, pdf)
+    best_pars = None
+    if not expected_only:
+        best_pars, _ = batched_fit(data, pdf, init_pars, par_bounds)
+    if asimov_pars is None:
+        asimov_pars = batched_background_fit(data, pdf, init_pars, par_bounds)
+    return best_pars, np.array(np.broadcast_to(asimov_pars, init_pars.shape))
+
+
+def batched_hypotest(
+    poi_test,
+    data,
+    pdf,
+    qtilde=True,
+    asimov_pars=None,
+    minimum=None,
+    expected_only=False,
+):
+    """
+    Batched equivalent of ``pyhf.infer.hypotest(..., return_expected_set=True)``
+    for a model built with ``batch_size``. ``poi_test`` can be a scalar or hold
+    one value per batch slot. If the parameters of the background-only Asimov
+    dataset are passed as ``asimov_pars``, the conditional fits at mu=0 are
+    skipped, and so are the unconditional fits to the Asimov dataset, whose
+    minimum is at ``asimov_pars`` by construction. The unconditional fits to
+    the observed data are skipped if their best-fit parameters are passed as
+    ``minimum``. With ``expected_only``, only the expected CLs band is computed
+    and the observed CLs is None.
+
+    Returns:
+        Tuple of observed CLs, shape (batch_size,), and expected CLs band as a
+        list of five arrays of shape (batch_size,).
+    """
+    batch_size = pdf.batch_size
+    poi_index = pdf.config.poi_index
+    mu = np.broadcast_to(np.asarray(poi_test, dtype=float), (batch_size,))
+    data, init_pars, par_bounds = _batched_setup(data, pdf)
+
+    qmu = None
+    if not expected_only:
+        qmu = _batched_qmu(
+            mu, data, pdf, init_pars, par_bounds, poi_index, minimum=minimum
+        )
+
+    shared = asimov_pars is not None
+    if not shared:
+        asimov_pars = batched_background_fit(data, pdf, init_pars, par_bounds)
+    asimov_pars = np.array(np.broadcast_to(asimov_pars, init_pars.shape))
+    tensorlib, _ = pyhf.get_backend()
+    asimov_data = np.asarray(
+        tensorlib.tolist(pdf.expected_data(tensorlib.astensor(asimov_pars))),
+        dtype=float,
+    )
+
+    qmu_A = _batched_qmu(
+        mu,
+        asimov_data,
+        pdf,
+        init_pars,
+        par_bounds,
+        poi_index,
+        minimum=asimov_pars if shared else None,
+    )
+
+    return asymptotic_cls(qmu, qmu_A, qtilde=qtilde)
+
+
+def _qmu(mu, data, pdf, init_pars, par_bounds, fixed_params, minimum=None):
+    tensorlib, _ = pyhf.get_backend()
+    _, fixed_nll = pyhf.infer.mle.fixed_poi_fit(
+        mu, data, pdf, init_pars, par_bounds, fixed_params, return_fitted_val=True
+    )
+    if minimum is None:
+        free_pars, free_nll = pyhf.infer.mle.fit(
+            data, pdf, init_pars, par_bounds, fixed_params, return_fitted_val=True
+        )
+    else:
+        free_pars = tensorlib.astensor(minimum)
+        free_nll = pyhf.infer.mle.twice_nll(free_pars, data, pdf)
+    qmu = max(float(np.ravel(tensorlib.tolist(fixed_nll - free_nll))[0]), 0.0)
+    free_pars = np.asarray(tensorlib.tolist(free_pars), dtype=float)
+    if free_pars[pdf.config.poi_index] > mu:
+        qmu = 0.0
+    return qmu, free_pars
+
+
+def pars_by_name(pdf, pars):
+    """
+    Split a parameter vector of ``pdf`` into a dict of parameter name to values.
+    """
+    pars = np.asarray(pars, dtype=float)
+    return {
+        parameter: pars[pdf.config.par_slice(parameter)].tolist()
+        for parameter in pdf.config.par_order
+    }
+
+
+def pars_from_names(pdf, named_pars):
+    """
+    Parameter vector of ``pdf`` with the values of ``named_pars`` for all
+    parameters that it has in common with ``pdf``, clipped to their bounds, and
+    the suggested initial values for all others. Fixed parameters always keep
+    their initial value.
+    """
+    pars = list(pdf.config.suggested_init())
+    fixed_params = pdf.config.suggested_fixed()
+    bounds = pdf.config.suggested_bounds()
+    for parameter in pdf.config.par_order:
+        indices = range(len(pars))[pdf.config.par_slice(parameter)]
+        values = named_pars.get(parameter)
+        if values is None or len(values) != len(indices):
+            continue
+        for index, value in zip(indices, values):
+            if not fixed_params[index]:
+                pars[index] = min(max(value, bounds[index][0]), bounds[index][1])
+    return pars
+
+
+def background_fit(data, pdf):
+    """
+    Conditional fit at mu=0, the parameters of the background-only Asimov
+    dataset, as a dict of parameter name to values.
+    """
+    tensorlib, _ = pyhf.get_backend()
+    pars = pyhf.infer.mle.fixed_poi_fit(
+        0.0,
+        data,
+        pdf,
+        pdf.config.suggested_init(),
+        pdf.config.suggested_bounds(),
+        pdf.config.suggested_fixed(),
+    )
+    return pars_by_name(pdf, tensorlib.tolist(pars))
+
+
+def reference_fits(data, pdf, asimov_pars=None, expected_only=False):
+    """
+    Unconditional fit and conditional fit at mu=0, which do not depend on the
+    tested signal strength. The former is skipped (None) with
+    ``expected_only``, the latter if ``asimov_pars`` is given.
+    """
+    tensorlib, _ = pyhf.get_backend()
+    init_pars = pdf.config.suggested_init()
+    par_bounds = pdf.config.suggested_bounds()
+    fixed_params = pdf.config.suggested_fixed()
+    best_pars = None
+    if not expected_only:
+        best_pars = tensorlib.tolist(
+            pyhf.infer.mle.fit(data, pdf, init_pars, par_bounds, fixed_params)
+        )
+    if asimov_pars is None:
+        asimov_pars = pyhf.infer.mle.fixed_poi_fit(
+            0.0, data, pdf, init_pars, par_bounds, fixed_params
+        )
+    return best_pars, tensorlib.tolist(asimov_pars)
+
+
+def hypotest(
+    poi_test,
+    data,
+    pdf,
+    init_pars=None,
+    qtilde=True,
+    asimov_pars=None,
+    minimum=None,
+    expected_only=False,
+):
+    """
+    Equivalent of ``pyhf.infer.hypotest(..., return_expected_set=True)`` that
+    runs the same fits, but starts them from ``init_pars`` and also returns the
+    best-fit parameters of the unconstrained fit to the observed data.
+
+    If the parameters of the background-only Asimov dataset are passed as
+    ``asimov_pars``, the conditional fit at mu=0 is skipped, and so is the
+    unconditional fit to the Asimov dataset, whose minimum is at
+    ``asimov_pars`` by construction. The unconditional fit to the observed
+    data is skipped if its best-fit parameters are passed as ``minimum``.
+    With ``expected_only``, only the expected CLs band is computed and the
+    observed CLs and best-fit parameters are None.
+
+    Returns:
+        Tuple of observed CLs, expected CLs band and best-fit parameters.
+    """
+    tensorlib, _ = pyhf.get_backend()
+    if init_pars is None:
+        init_pars = pdf.config.suggested_init()
+    par_bounds = pdf.config.suggested_bounds()
+    fixed_params = pdf.config.suggested_fixed()
+
+    qmu, best_pars = None, None
+    if not expected_only:
+        qmu, best_pars = _qmu(
+            poi_test, data, pdf, init_pars, par_bounds, fixed_params, minimum=minimum
+        )
+        qmu = np.asarray(qmu)
+
+    shared = asimov_pars is not None
+    if not shared:
+        asimov_pars = pyhf.infer.mle.fixed_poi_fit(
+            0.0, data, pdf, init_pars, par_bounds, fixed_params
+        )
+    asimov_data = pdf.expected_data(tensorlib.astensor(asimov_pars))
+    qmu_A, _ = _qmu(
+        poi_test,
+        asimov_data,
+        pdf,
+        init_pars,
+        par_bounds,
+        fixed_params,
+        minimum=asimov_pars if shared else None,
+    )
+
+    obsCLs, expCLs = asymptotic_cls(qmu, np.asarray(qmu_A), qtilde=qtilde)
+    return obsCLs, expCLs, best_pars
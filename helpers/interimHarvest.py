@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import subprocess
+from time import time
+
+
+class InterimHarvest:
+    """
+    Harvest written periodically while a scan is running, every ``every``
+    completed points and/or every ``seconds`` seconds.
+
+    ``make_harvest`` returns the harvest of all results so far and ``write``
+    stores it, e.g. ``harvest.write_harvest``. After every interim harvest,
+    ``command`` is started in the background, with ``{harvest}`` replaced by
+    the path of the harvest file, unless the previous one is still running.
+    """
+
+    def __init__(
+        self, make_harvest, write, path, every=None, seconds=None, command=None
+    ):
+        self.make_harvest = make_harvest
+        self.write = write
+        self.path = path
+        self.every = every
+        self.seconds = seconds
+        self.command = command
+        self.process = None
+        self.pending = 0
+        self.last = time()
+
+    def completed(self, n_points=1):
+        self.pending += n_points
+        if (self.every and self.pending >= self.every) or (
+            self.seconds and time() - self.last >= self.seconds
+        ):
+            self.refresh()
+
+    def refresh(self):
+        harvest = self.make_harvest()
+        self.write(harvest, self.path)
+        self.pending = 0
+        self.last = time()
+
+        # expected-only harvests have no observed CLs
+        excluded = sum(point.get("CLs", 1.0) < 0.05 for point in harvest)
+        expected = sum(point["CLsexp"] < 0.05 for point in harvest)
+        print(
+            f"Interim harvest of {len(harvest)} point(s), {excluded} excluded ({expected} expected): {self.path}"
+        )
+
+        if self.command and (self.process is None or self.process.poll() is not None):
+            self.process = subprocess.Popen(
+                self.command.format(harvest=self.path), shell=True
+            )
+
+    def close(self):
+        """
+        Write a last interim harvest if any point completed since the previous
+        one, and wait for the contour command.
+        """
+        if self.process is not None:
+            self.process.wait()
+        if self.pending:
+            self.refresh()
+        if self.process is not None:
+            self.process.wait()
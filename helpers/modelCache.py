@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import os
+import pathlib
+import pickle
+
+import pyhf
+
+from helpers.profiler import count, stage
+
+
+class ModelCache:
+    """
+    Built pyhf models pickled to disk, so that large specs are only turned into
+    a model once. Models are keyed by the digest of their spec, the settings
+    they are built with (modifier settings, batch size, ...), the backend and
+    the pyhf version, as the precomputed tensors depend on all of them.
+
+    Hits and misses are counted as ``model_cache_hit`` and ``model_cache_miss``
+    in the profiler.
+    """
+
+    def __init__(self, directory):
+        self.directory = pathlib.Path(directory)
+
+    @staticmethod
+    def key(spec, **settings):
+        return pyhf.utils.digest(
+            {
+                "spec": pyhf.utils.digest(spec),
+                "backend": pyhf.tensorlib.name,
+                "pyhf": pyhf.__version__,
+                **settings,
+            }
+        )
+
+    def model(self, spec, build, **settings):
+        """
+        The model of ``spec`` from the cache, or built by calling ``build()``
+        and stored.
+        """
+        path = self.directory / f"{self.key(spec, **settings)}.pkl"
+        if path.exists():
+            try:
+                with stage("load_model"):
+                    with path.open("rb") as model_file:
+                        pdf = pickle.load(model_file)
+                count("model_cache_hit")
+                return pdf
+            except Exception:
+                # a truncated or otherwise unreadable file is rebuilt
+                pass
+        count("model_cache_miss")
+        pdf = build()
+        with stage("store_model"):
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # several workers may store the same model, each via its own file
+            partial = path.with_name(f".{path.name}.{os.getpid()}.partial")
+            with partial.open("wb") as model_file:
+                pickle.dump(pdf, model_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(partial, path)
+        return pdf
+
+
+def model_cache_path(group):
+    return pathlib.Path(f"analyses/{group}/cache/models")
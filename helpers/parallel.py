@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import multiprocessing
+import os
+import sys
+import traceback
+
+import pyhf
+
+# the BLAS of numpy is loaded (and has read OMP_NUM_THREADS & co.) before the
+# workers are forked, so only threadpoolctl can still limit its threads
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+# filled in the parent before the workers are forked, so that e.g. the parsed
+# background-only spec is shared copy-on-write instead of pickled per task
+shared = {}
+
+
+def threads_per_job(jobs):
+    return max(1, (os.cpu_count() or 1) // max(1, jobs))
+
+
+def init_worker(backend, optimizer, threads):
+    """
+    Set backend and thread count explicitly in every worker, so that several
+    workers do not oversubscribe the cores with BLAS or torch threads.
+    """
+    if threadpool_limits is not None:
+        threadpool_limits(threads)
+
+    if backend == "pytorch":
+        import torch
+
+        torch.set_num_threads(threads)
+    elif backend == "tensorflow":
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+    pyhf.set_backend(backend, optimizer)
+
+
+def _call(task):
+    func, index, item = task
+    try:
+        return index, func(item), None
+    except Exception:
+        return index, None, traceback.format_exc()
+
+
+def run_parallel(
+    func, items, jobs=1, backend="numpy", optimizer=None, cost=None, **kwargs
+):
+    """
+    Apply ``func`` to all ``items`` on a pool of ``jobs`` forked workers.
+
+    Yields ``(item, result, error)`` in the order of ``items``, where ``error``
+    is the formatted traceback if ``func`` raised for this item and None
+    otherwise. Additional keyword arguments are put into ``shared`` before the
+    workers are forked. With ``jobs=1`` everything runs in this process.
+
+    If ``cost`` estimates the run time of an item, the workers take the items
+    longest first (and they are yielded in that order), so that the scan does
+    not end with one slow item running while the other workers are idle.
+    """
+    items = list(items)
+    shared.update(kwargs)
+
+    if jobs <= 1:
+        for index, item in enumerate(items):
+            _, result, error = _call((func, index, item))
+            yield item, result, error
+        return
+
+    if threadpool_limits is None:
+        print(
+            "threadpoolctl is not installed, every worker uses all cores for BLAS."
+            " Install it (pip install threadpoolctl) or set OMP_NUM_THREADS before"
+            " starting the scan.",
+            file=sys.stderr,
+        )
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(
+        jobs,
+        initializer=init_worker,
+        initargs=(backend, optimizer, threads_per_job(jobs)),
+    ) as pool:
+        tasks = [(func, index, item) for index, item in enumerate(items)]
+        if cost is not None:
+            tasks.sort(key=lambda task: cost(task[2]), reverse=True)
+        for index, result, error in pool.imap(_call, tasks, chunksize=1):
+            yield items[index], result, error
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import jsonpatch
+import jsonpointer
+
+import pyhf
+
+# marks dict keys that did not exist before an ``add``
+_missing = object()
+
+
+class InPlacePatch:
+    """
+    A JSON patch compiled into direct edits of a shared spec, which can be
+    applied in place and undone again, instead of deep-copying the whole spec
+    for every patch like ``jsonpatch.apply_patch`` does.
+
+    Only ``add``, ``remove`` and ``replace`` are supported, the ops used by
+    signal patches.
+    """
+
+    supported_ops = ("add", "remove", "replace")
+
+    def __init__(self, patch):
+        self.patch = patch
+        self.ops = []
+        for op in patch:
+            if op["op"] not in self.supported_ops:
+                raise ValueError(f"Cannot apply '{op['op']}' in place: {op['path']}")
+            parts = jsonpointer.JsonPointer(op["path"]).parts
+            if not parts:
+                raise ValueError("Cannot replace the whole document in place")
+            self.ops.append((op["op"], parts[:-1], parts[-1], op.get("value")))
+        self.undo_log = []
+
+    @staticmethod
+    def _resolve(spec, parents):
+        target = spec
+        for part in parents:
+            target = target[int(part) if isinstance(target, list) else part]
+        return target
+
+    def apply(self, spec, verify=False):
+        """
+        Apply the patch to ``spec`` in place. With ``verify``, check that the
+        result is identical to the one of ``jsonpatch.apply_patch``.
+        """
+        if self.undo_log:
+            raise RuntimeError("Patch is already applied")
+        expected = jsonpatch.apply_patch(spec, self.patch) if verify else None
+
+        try:
+            for op, parents, key, value in self.ops:
+                target = self._resolve(spec, parents)
+                if isinstance(target, list):
+                    index = len(target) if key == "-" else int(key)
+                    old = None
+                    if op == "add":
+                        if index > len(target):
+                            raise IndexError(f"Index {index} out of range")
+                        target.insert(index, value)
+                    elif op == "remove":
+                        old = target.pop(index)
+                    else:
+                        old = target[index]
+                        target[index] = value
+                    self.undo_log.append((op, target, index, old))
+                else:
+                    if op != "add" and key not in target:
+                        raise KeyError(key)
+                    self.undo_log.append((op, target, key, target.get(key, _missing)))
+                    if op == "remove":
+                        del target[key]
+                    else:
+                        target[key] = value
+        except Exception:
+            self.undo(spec)
+            raise
+
+        if verify and spec != expected:
+            self.undo(spec)
+            raise RuntimeError("In-place patch differs from jsonpatch result")
+
+    def undo(self, spec, digest=None):
+        """
+        Revert all edits of ``apply``. If the ``digest`` of the unpatched spec
+        is given, check that the spec is restored.
+        """
+        while self.undo_log:
+            op, target, key, old = self.undo_log.pop()
+            if isinstance(target, list):
+                if op == "add":
+                    del target[key]
+                elif op == "remove":
+                    target.insert(key, old)
+                else:
+                    target[key] = old
+            elif old is _missing:
+                del target[key]
+            else:
+                target[key] = old
+
+        if digest and pyhf.utils.digest(spec) != digest:
+            raise RuntimeError("Spec was not restored after undoing the patch")
+
+
+def model_from_spec(spec, **config_kwargs):
+    """
+    Build data and model of the first measurement of a workspace spec directly,
+    without the deep copy and validation of an intermediate pyhf.Workspace.
+    The model keeps its own copy of the spec, so ``spec`` can be modified again
+    afterwards.
+    """
+    measurement = spec["measurements"][0]["config"]
+    pdf = pyhf.Model(
+        {"channels": spec["channels"], "parameters": measurement["parameters"]},
+        poi_name=measurement["poi"],
+        **config_kwargs,
+    )
+    observations = {
+        observation["name"]: observation["data"] for observation in spec["observations"]
+    }
+    data = sum((observations[c] for c in pdf.config.channels), [])
+    return data + pdf.config.auxdata, pdf
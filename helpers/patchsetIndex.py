@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import collections
+import json
+import mmap
+import pathlib
+import re
+
+import pyhf
+
+# strings (with escapes, and whether they are an object key) and brackets,
+# everything else is irrelevant for finding the boundaries of the patches
+token_pattern = re.compile(rb'"(?:[^"\\]|\\.)*"(\s*:)?|[{}\[\]]')
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry", ["name", "values", "offset", "length", "digest", "n_ops"]
+)
+
+
+def _scan(buffer):
+    """
+    Find the byte ranges of the top-level ``patches`` array and of each of its
+    elements without parsing the patches.
+    """
+    depth = 0
+    key = None
+    array = None
+    elements = []
+    start = None
+    for match in token_pattern.finditer(buffer):
+        token = match.group()
+        if token[:1] == b'"':
+            if depth == 1 and match.group(1):
+                key = token[: -len(match.group(1))]
+            continue
+        if token in (b"{", b"["):
+            depth += 1
+            if depth == 2 and token == b"[" and key == b'"patches"':
+                array = [match.start(), None]
+            elif depth == 3 and array and array[1] is None:
+                start = match.start()
+        else:
+            depth -= 1
+            if depth == 2 and start is not None:
+                elements.append((start, match.end() - start))
+                start = None
+            elif depth == 1 and array and array[1] is None:
+                array[1] = match.end()
+    if not array or array[1] is None:
+        raise ValueError("No patches found in patchset")
+    return array, elements
+
+
+class PatchsetIndex:
+    """
+    Read-only view of a patchset file that only parses the requested patches.
+
+    On first use, the byte offsets, names, values and digests of all patches
+    are collected and stored next to the patchset as ``<patchset>.index``. The
+    index is rebuilt whenever size or modification time of the file change.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.index_path = self.path.with_name(self.path.name + ".index")
+
+        stat = self.path.stat()
+        self.stamp = [stat.st_size, stat.st_mtime_ns]
+
+        index = None
+        if self.index_path.exists():
+            try:
+                index = json.load(open(self.index_path, "r"))
+            except json.JSONDecodeError:
+                index = None
+        if not index or index["stamp"] != self.stamp:
+            index = self._build_index()
+            try:
+                with open(self.index_path, "w") as index_file:
+                    json.dump(index, index_file)
+            except OSError:
+                # read-only location, the index is simply rebuilt next time
+                pass
+
+        self.metadata = index["metadata"]
+        self.version = index["version"]
+        self.entries = [IndexEntry(**entry) for entry in index["entries"]]
+        self._by_name = {entry.name: entry for entry in self.entries}
+
+    def _build_index(self):
+        with open(self.path, "rb") as patchset_file, mmap.mmap(
+            patchset_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as buffer:
+            (start, end), elements = _scan(buffer)
+
+            header = json.loads(buffer[: start + 1] + buffer[end - 1 :])
+            entries = []
+            for offset, length in elements:
+                patch = pyhf.patchset.Patch(
+                    json.loads(buffer[offset : offset + length])
+                )
+                entries.append(
+                    {
+                        "name": patch.name,
+                        "values": list(patch.values),
+                        "offset": offset,
+                        "length": length,
+                        "digest": pyhf.utils.digest(patch.patch),
+                        "n_ops": len(patch.patch),
+                    }
+                )
+
+        return {
+            "stamp": self.stamp,
+            "metadata": header["metadata"],
+            "version": header["version"],
+            "entries": entries,
+        }
+
+    @property
+    def labels(self):
+        return self.metadata["labels"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for entry in self.entries:
+            yield self.load(entry)
+
+    def __getitem__(self, key):
+        """
+        Load a patch by name, by its values or by its position in the file.
+        """
+        if isinstance(key, int):
+            return self.load(self.entries[key])
+        if isinstance(key, str):
+            return self.load(self._by_name[key])
+        for entry in self.entries:
+            if tuple(entry.values) == tuple(key):
+                return self.load(entry)
+        raise KeyError(key)
+
+    def load(self, entry):
+        with open(self.path, "rb") as patchset_file:
+            patchset_file.seek(entry.offset)
+            return pyhf.patchset.Patch(json.loads(patchset_file.read(entry.length)))
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import cProfile
+import collections
+import contextlib
+import io
+import json
+import pstats
+import resource
+import sys
+from functools import wraps
+from time import perf_counter, time
+
+import numpy as np
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process and of its finished children, in MB.
+    """
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    scale = 1 / 1024**2 if sys.platform == "darwin" else 1 / 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def histogram(durations, bins=10):
+    """
+    Summary statistics and a log-spaced histogram of a list of durations.
+    """
+    durations = np.asarray(durations, dtype=float)
+    low, high = max(durations.min(), 1e-6), max(durations.max(), 1e-6)
+    edges = np.geomspace(low, max(high, low) * (1 + 1e-9), bins + 1)
+    counts, edges = np.histogram(np.clip(durations, low, None), bins=edges)
+    return {
+        "count": int(durations.size),
+        "total": float(durations.sum()),
+        "mean": float(durations.mean()),
+        "median": float(np.median(durations)),
+        "p95": float(np.percentile(durations, 95)),
+        "max": float(durations.max()),
+        "histogram": {"edges": np.asarray(edges).tolist(), "counts": counts.tolist()},
+    }
+
+
+class Profiler:
+    """
+    Wall-clock time per stage of every point, collected per process.
+
+    Stages are timed with the ``timed`` decorator or the ``stage`` context
+    manager, events (e.g. cache hits) are counted with ``count``. Inside
+    ``point``, they are attributed to that point, otherwise to the run as a
+    whole (e.g. setup or writing results). Workers return their point records,
+    which the parent collects with ``add``, so nothing is shared between
+    concurrently running points.
+
+    With ``profile_slowest`` set, every point runs under cProfile and the
+    statistics of the slowest points are kept.
+    """
+
+    def __init__(self, profile_slowest=0):
+        self.profile_slowest = profile_slowest
+        self.current = None
+        self.records = []
+        self.totals = []
+        self.run_stages = collections.defaultdict(list)
+        self.run_counters = collections.Counter()
+        self.start = time()
+
+    def timed(self, name):
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            if self.current is None:
+                self.run_stages[name].append(duration)
+            else:
+                stages = self.current["stages"]
+                stages[name] = stages.get(name, 0.0) + duration
+
+    def count(self, name, n=1):
+        if self.current is None:
+            self.run_counters[name] += n
+        else:
+            counters = self.current["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+    @contextlib.contextmanager
+    def point(self, *names):
+        """
+        Attribute all stages inside to a new record for the point(s) ``names``
+        (several for a batch). The record is complete once the block is left.
+        """
+        record = {"points": list(names), "stages": {}, "counters": {}}
+        self.current = record
+        profile = cProfile.Profile() if self.profile_slowest else None
+        start = perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile:
+                profile.disable()
+            record["total"] = perf_counter() - start
+            record["peak_rss"] = peak_rss()["self"]
+            self.current = None
+            if profile and self._is_slow(record["total"]):
+                stream = io.StringIO()
+                stats = pstats.Stats(profile, stream=stream)
+                stats.sort_stats("cumulative").print_stats(30)
+                record["profile"] = stream.getvalue()
+            self.totals.append(record["total"])
+
+    def _is_slow(self, total):
+        # only among the points of this process, the parent picks the overall slowest
+        slowest = sorted(self.totals, reverse=True)[: self.profile_slowest]
+        return len(slowest) < self.profile_slowest or total > slowest[-1]
+
+    def add(self, record):
+        self.records.append(record)
+
+    def summary(self):
+        stages = collections.defaultdict(list)
+        for record in self.records:
+            for name, duration in record["stages"].items():
+                stages[name].append(duration)
+        run_stages = {
+            name: histogram(durations) for name, durations in self.run_stages.items()
+        }
+        counters = collections.Counter(self.run_counters)
+        for record in self.records:
+            counters.update(record.get("counters", {}))
+        totals = [record["total"] for record in self.records]
+        return {
+            "wall_time": time() - self.start,
+            "peak_rss_mb": max(
+                [*peak_rss().values(), *(r["peak_rss"] for r in self.records)]
+            ),
+            "run": run_stages,
+            "stages": {
+                name: histogram(durations) for name, durations in stages.items()
+            },
+            "points": histogram(totals) if totals else None,
+            "counters": dict(sorted(counters.items())),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(
+            f"wall time {summary['wall_time']:.2f}s, peak RSS {summary['peak_rss_mb']:.0f} MB"
+        )
+        for kind, title in (("run", "run"), ("stages", "per point")):
+            if summary[kind]:
+                print(f" {title}:")
+            for name, stats in summary[kind].items():
+                print(
+                    f"  {name:<16} n={stats['count']:<5} total={stats['total']:.3f}s "
+                    f"mean={stats['mean']:.4f}s p95={stats['p95']:.4f}s max={stats['max']:.4f}s"
+                )
+        if summary["counters"]:
+            print(" counters:")
+        for name, value in summary["counters"].items():
+            print(f"  {name:<16} {value}")
+
+    def write_trace(self, path):
+        slowest = sorted(self.records, key=lambda r: r["total"], reverse=True)
+        profiles = [
+            {"points": r["points"], "total": r["total"], "profile": r["profile"]}
+            for r in slowest[: self.profile_slowest]
+            if "profile" in r
+        ]
+        records = [
+            {key: value for key, value in r.items() if key != "profile"}
+            for r in self.records
+        ]
+        with open(path, "w") as trace_file:
+            json.dump(
+                {
+                    "summary": self.summary(),
+                    "records": records,
+                    "profiles": profiles,
+                },
+                trace_file,
+                indent=2,
+            )
+
+
+def print_timings(record):
+    print(
+        *(f"{stage}={duration:.6f}" for stage, duration in record["stages"].items()),
+        sep=" ",
+    )
+
+
+# one profiler per process, workers send their records to the parent
+profiler = Profiler()
+timed = profiler.timed
+stage = profiler.stage
+count = profiler.count
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import pathlib
+
+import pyhf
+
+from helpers.resultStore import append_record, read_records
+
+
+class ResultCache:
+    """
+    A persistent cache of fit results, keyed by the digest of everything that
+    goes into a fit (background-only spec, patch, backend, settings, ...).
+
+    Entries are appended to a JSON-lines file, so an interrupted run loses at
+    most the point that was being written.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.entries = {
+            entry["key"]: entry["result"] for entry in read_records(self.path)
+        }
+
+    @staticmethod
+    def key(**components):
+        return pyhf.utils.digest(components)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, result):
+        self.entries[key] = result
+        append_record(self.path, {"key": key, "result": result})
+
+
+def cache_path(group):
+    return pathlib.Path(f"analyses/{group}/cache/results.jsonl")
+
+
+def cls_result(obsCLs, expCLs):
+    # expected-only results have no observed CLs
+    result = {"CLs_exp": [float(i.tolist()) for i in expCLs]}
+    if obsCLs is not None:
+        result["CLs_obs"] = float(obsCLs.tolist())
+    return result
+
+
+def limit_result(obs_limit, exp_limits, observed=True):
+    result = {"UL_exp": exp_limits}
+    if observed:
+        result["UL_obs"] = obs_limit
+    return result
+
+
+def curve_result(curve):
+    return {"curve": curve}
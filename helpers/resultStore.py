@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+import atexit
+import json
+import os
+import pathlib
+
+
+def read_records(path):
+    """
+    Yield the records of a JSON-lines file, skipping a line that was cut off by
+    an interrupted write.
+    """
+    path = pathlib.Path(path)
+    if not path.exists():
+        return
+    with path.open() as records_file:
+        for line in records_file:
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+# files of append_record, kept open until sync_records
+_record_files = {}
+
+
+def append_record(path, record):
+    """
+    Append a record to a JSON-lines file. The file is kept open and every
+    record is flushed right away, but only synced to disk by ``sync_records``,
+    once per batch of records and at exit. A record cut off by a crash is
+    skipped by ``read_records``.
+    """
+    path = pathlib.Path(path)
+    records_file = _record_files.get(path)
+    if records_file is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        records_file = _record_files[path] = path.open("a+b")
+        # start a new line if a previous write was cut off
+        if records_file.tell() > 0:
+            records_file.seek(-1, os.SEEK_END)
+            if records_file.read(1) != b"\n":
+                records_file.write(b"\n")
+    records_file.write(json.dumps(record).encode() + b"\n")
+    records_file.flush()
+
+
+def sync_records():
+    """
+    Sync all records appended so far to disk and close their files.
+    """
+    while _record_files:
+        _, records_file = _record_files.popitem()
+        os.fsync(records_file.fileno())
+        records_file.close()
+
+
+atexit.register(sync_records)
+
+
+class ResultStore:
+    """
+    All results of a group in a single append-only JSON-lines file, indexed by
+    the name the legacy per-point result file would have had (without
+    ``.json``). A later record for the same name replaces an earlier one.
+    Names appended since the store was opened are kept in ``written``.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self.records = {record["name"]: record for record in read_records(self.path)}
+        self.written = set()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def get(self, name):
+        return self.records.get(name)
+
+    def append(self, name, result):
+        record = {"name": name, **result}
+        self.written.add(name)
+        if self.records.get(name) == record:
+            return
+        append_record(self.path, record)
+        self.records[name] = record
+
+    def export(self, directory, names=None):
+        """
+        Write the legacy per-point result files, ``<name>.json``, into
+        ``directory``. Returns the list of written files.
+        """
+        directory = pathlib.Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        written = []
+        for record in self:
+            if names is not None and record["name"] not in names:
+                continue
+            result = {key: value for key, value in record.items() if key != "name"}
+            filename = directory / f"{record['name']}.json"
+            with open(filename, "w") as fp:
+                json.dump(result, fp)
+            written.append(filename)
+        return written
+
+
+def store_path(group):
+    return pathlib.Path(f"analyses/{group}/results/results.jsonl")
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import re
+
+import jsonpatch
+import numpy as np
+
+import pyhf
+
+sample_path_pattern = re.compile("^/channels/([0-9]+)/samples/([0-9]+)$")
+
+
+def signal_ops(patch):
+    """
+    Return the list of ``add`` ops of a patch if it only adds samples, else None.
+    """
+    ops = []
+    for op in patch:
+        if op["op"] != "add" or not sample_path_pattern.match(op["path"]):
+            return None
+        ops.append(op)
+    return ops
+
+
+# modifiers of a signal sample that change constraint terms it shares with the
+# background (e.g. the combined MC stat uncertainty of a bin)
+shared_constraint_modifiers = {"staterror", "shapesys"}
+
+
+def shares_background(ops):
+    """
+    Return True if ``ops`` only add signal samples that leave the likelihood at
+    mu=0 unchanged, so that the background-only fit is the same with and
+    without them.
+    """
+    return ops is not None and all(
+        modifier["type"] not in shared_constraint_modifiers
+        for op in ops
+        for modifier in op["value"]["modifiers"]
+    )
+
+
+# modifiers that only scale a sample, so that its nominal rates can be replaced
+# in a built model; the others are built from the rates (e.g. histosys deltas,
+# staterror and shapesys relative uncertainties)
+scaling_modifiers = {"lumi", "normfactor", "normsys", "shapefactor"}
+
+
+def swappable_rates():
+    """
+    Return True if nominal rates can be replaced in a built model. This writes
+    to the NumPy arrays of pyhf 0.5 internals (``_nominal_rates``, refreshed by
+    ``_precompute``), which other backends and pyhf versions do not use.
+    """
+    return pyhf.tensorlib.name == "numpy" and pyhf.__version__.startswith("0.5.")
+
+
+def template_ops(patches):
+    """
+    Build the ops of a template patch if all patches only add a signal sample
+    with identical scaling modifiers at the same ``/channels/N/samples/M``
+    paths, i.e. if they only differ in the nominal signal rates. Patches may
+    skip channels in which they have no signal. Returns None for incompatible
+    patches.
+    """
+    template = {}
+    for patch in patches:
+        ops = signal_ops(patch.patch)
+        if ops is None or len({op["path"] for op in ops}) != len(ops):
+            return None
+        for op in ops:
+            reference = template.setdefault(op["path"], op)
+            if op["value"]["modifiers"] != reference["value"]["modifiers"]:
+                return None
+            if any(
+                modifier["type"] not in scaling_modifiers
+                for modifier in op["value"]["modifiers"]
+            ):
+                return None
+            if len(op["value"]["data"]) != len(reference["value"]["data"]):
+                return None
+    if not template:
+        return None
+
+    # a single signal sample, named after the first one, with zero rates
+    name = next(iter(template.values()))["value"]["name"]
+    return [
+        {
+            "op": "add",
+            "path": path,
+            "value": {
+                "name": name,
+                "data": [0.0] * len(op["value"]["data"]),
+                "modifiers": op["value"]["modifiers"],
+            },
+        }
+        for path, op in template.items()
+    ]
+
+
+class SignalTemplate:
+    """
+    A pyhf model built once from the template ops of a patchset, whose nominal
+    signal rates can be swapped for those of any compatible patch.
+
+    With ``batch_size`` set, every batch slot holds the signal of a different
+    patch, so that all of them can be evaluated in a single vectorized pass.
+    The model is taken from ``model_cache`` if given. Requires
+    ``swappable_rates()``.
+    """
+
+    def __init__(self, spec, ops, modifier_settings, batch_size=None, model_cache=None):
+        if not swappable_rates():
+            raise RuntimeError(
+                f"Cannot swap signal rates with the {pyhf.tensorlib.name} backend of pyhf {pyhf.__version__}"
+            )
+        self.batch_size = batch_size
+        self.ops = ops
+        self.workspace = pyhf.Workspace(jsonpatch.apply_patch(spec, ops))
+
+        def build():
+            return self.workspace.model(
+                batch_size=batch_size, modifier_settings=modifier_settings
+            )
+
+        if model_cache is None:
+            self.pdf = build()
+        else:
+            self.pdf = model_cache.model(
+                self.workspace,
+                build,
+                batch_size=batch_size,
+                modifier_settings=modifier_settings,
+            )
+        self.data = self.workspace.data(self.pdf)
+
+        # map each op path onto the (sample, bin slice) it fills in the model
+        self.targets = {}
+        for op in ops:
+            channel_index = int(sample_path_pattern.match(op["path"]).group(1))
+            channel = spec["channels"][channel_index]["name"]
+            self.targets[op["path"]] = (
+                self.pdf.config.samples.index(op["value"]["name"]),
+                self.pdf.config.channel_slices[channel],
+            )
+
+    def set_signal(self, patch, slot=None):
+        """
+        Replace the nominal signal rates by those of ``patch``, either in all
+        batch slots or only in ``slot``.
+        """
+        self._fill(patch, slice(None) if slot is None else slot)
+        self.pdf.main_model._precompute()
+
+    def set_signals(self, patches):
+        """
+        Fill the batch slots with the signals of ``patches``. Unused slots repeat
+        the last signal. Returns the number of slots that hold a real patch.
+        """
+        for slot in range(self.batch_size):
+            self._fill(patches[min(slot, len(patches) - 1)], slot)
+        self.pdf.main_model._precompute()
+        return len(patches)
+
+    def _fill(self, patch, slots):
+        nominal_rates = self.pdf.main_model._nominal_rates
+        for sample_index, bins in self.targets.values():
+            nominal_rates[0, sample_index, slots, bins] = 0.0
+        for op in signal_ops(patch.patch):
+            sample_index, bins = self.targets[op["path"]]
+            nominal_rates[0, sample_index, slots, bins] = np.asarray(
+                op["value"]["data"], dtype=float
+            )
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+
+import numpy as np
+import scipy.special
+
+from helpers.inference import asymptotic_cls
+from helpers.signalTemplate import signal_ops
+
+# position of the parameters in the engine's own parameter vectors
+poi, alpha, lumi = 0, 1, 2
+
+
+def is_simplified(spec, ops):
+    """
+    Return True if ``spec`` has a single background sample per channel whose
+    only modifier is one histosys shared by all channels, and the template
+    ``ops`` only add signal samples with a lumi and a normfactor modifier.
+    """
+    if ops is None:
+        return False
+    histosys = set()
+    for channel in spec["channels"]:
+        if len(channel["samples"]) != 1:
+            return False
+        modifiers = channel["samples"][0]["modifiers"]
+        if len(modifiers) != 1 or modifiers[0]["type"] != "histosys":
+            return False
+        histosys.add(modifiers[0]["name"])
+    if len(histosys) != 1:
+        return False
+    poi_name = spec["measurements"][0]["config"]["poi"]
+    for op in ops:
+        modifiers = op["value"]["modifiers"]
+        if sorted(
+            (m["type"], m["type"] == "normfactor" and m["name"] == poi_name)
+            for m in modifiers
+        ) != [("lumi", False), ("normfactor", True)]:
+            return False
+    return True
+
+
+class SimplifiedEngine:
+    """
+    Vectorized likelihood of a simplified model (see ``is_simplified``), with
+    the signals of many points held in arrays of shape (n_points, n_bins).
+
+    Expected rates, NLL, gradient and Hessian are computed in closed form,
+    with the histosys interpolated using code4p as in ``run_patchset.py``.
+    Bins, bounds, initial values and constraints are taken from the pyhf
+    model of a ``SignalTemplate``, so that both describe the same likelihood.
+    """
+
+    def __init__(self, template):
+        pdf = template.pdf
+        config = pdf.config
+        self.targets = template.targets
+
+        (self.histosys,) = {
+            channel["samples"][0]["modifiers"][0]["name"]
+            for channel in template.workspace["channels"]
+        }
+        names = [config.par_order[config.poi_index], self.histosys, "lumi"]
+        indices = [config.par_slice(name).start for name in names]
+        self.init_pars = np.asarray(config.suggested_init(), dtype=float)[indices]
+        self.par_bounds = np.asarray(config.suggested_bounds(), dtype=float)[indices]
+        fixed = np.asarray(config.suggested_fixed())[indices]
+        self.par_bounds[fixed] = self.init_pars[fixed, None]
+
+        # constraint terms of the histosys and lumi parameters
+        self.auxdata = np.array(
+            [
+                0.0,
+                config.param_set(self.histosys).auxdata[0],
+                config.param_set("lumi").auxdata[0],
+            ]
+        )
+        self.sigmas = np.array([1.0, 1.0, config.param_set("lumi").sigmas[0]])
+
+        # background rates and their histosys variations in the bin order of pdf
+        self.n_bins = config.nmaindata
+        nominal, up, down = (np.zeros(self.n_bins) for _ in range(3))
+        for channel in template.workspace["channels"]:
+            sample = channel["samples"][0]
+            modifier = sample["modifiers"][0]["data"]
+            bins = config.channel_slices[channel["name"]]
+            nominal[bins] = sample["data"]
+            up[bins] = modifier["hi_data"]
+            down[bins] = modifier["lo_data"]
+        self.background = nominal
+        self.delta_up = up - nominal
+        self.delta_down = nominal - down
+        self.data = np.asarray(template.data[: self.n_bins], dtype=float)
+
+    def signals(self, patches):
+        """
+        Nominal signal rates of ``patches``, shape (n_points, n_bins).
+        """
+        signal = np.zeros((len(patches), self.n_bins))
+        for point, patch in enumerate(patches):
+            for op in signal_ops(patch.patch):
+                signal[point, self.targets[op["path"]][1]] = op["value"]["data"]
+        return signal
+
+    def _interpolate(self, a):
+        """
+        code4p interpolated background shift and its first two derivatives in
+        the histosys parameter ``a``, shape (n_points, 1) each.
+        """
+        a = a[:, None]
+        S = 0.5 * (self.delta_up + self.delta_down)
+        A = 0.0625 * (self.delta_up - self.delta_down)
+        a2 = a * a
+        inside = (
+            a * S + A * a2 * (15.0 + a2 * (-10.0 + a2 * 3.0)),
+            S + A * a * (30.0 + a2 * (-40.0 + a2 * 18.0)),
+            A * (30.0 + a2 * (-120.0 + a2 * 90.0)),
+        )
+        delta = np.where(a > 1, self.delta_up, np.where(a < -1, self.delta_down, 0.0))
+        outside = (a > 1) | (a < -1)
+        return (
+            np.where(outside, a * delta, inside[0]),
+            np.where(outside, delta, inside[1]),
+            np.where(outside, 0.0, inside[2]),
+        )
+
+    def expected_data(self, pars, signal):
+        shift, _, _ = self._interpolate(pars[:, alpha])
+        return (
+            (pars[:, poi] * pars[:, lumi])[:, None] * signal + self.background + shift
+        )
+
+    def twice_nll(self, pars, signal, data, auxdata):
+        """
+        Twice the negative log-likelihood per point, identical to
+        ``-2 * pdf.logpdf`` of the pyhf model. Unphysical rates give inf.
+        """
+        rates = self.expected_data(pars, signal)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            poisson = rates - data * np.log(rates) + scipy.special.gammaln(data + 1.0)
+            poisson = np.where(rates > 0, poisson, np.inf).sum(axis=1)
+        pulls = ((pars[:, 1:] - auxdata[:, 1:]) / self.sigmas[1:]) ** 2
+        norm = 2 * np.log(self.sigmas[1:] * np.sqrt(2 * np.pi)).sum()
+        return 2 * poisson + pulls.sum(axis=1) + norm
+
+    def derivatives(self, pars, signal, data, auxdata):
+        """
+        Gradient, shape (n_points, 3), and Hessian, shape (n_points, 3, 3), of
+        twice the NLL.
+        """
+        shift, dshift, d2shift = self._interpolate(pars[:, alpha])
+        mu, lumi_value = pars[:, poi, None], pars[:, lumi, None]
+        rates = mu * lumi_value * signal + self.background + shift
+        jacobian = np.stack(
+            [lumi_value * signal, np.broadcast_to(dshift, rates.shape), mu * signal],
+            axis=1,
+        )
+        residual = 1.0 - data / rates
+        grad = 2 * np.einsum("pkb,pb->pk", jacobian, residual)
+        grad[:, 1:] += 2 * (pars[:, 1:] - auxdata[:, 1:]) / self.sigmas[1:] ** 2
+
+        hessian = 2 * np.einsum("pkb,plb,pb->pkl", jacobian, jacobian, data / rates**2)
+        cross = 2 * np.einsum("pb,pb->p", signal, residual)
+        hessian[:, poi, lumi] += cross
+        hessian[:, lumi, poi] += cross
+        hessian[:, alpha, alpha] += 2 * np.einsum("pb,pb->p", d2shift, residual)
+        hessian[:, alpha, alpha] += 2 / self.sigmas[alpha] ** 2
+        hessian[:, lumi, lumi] += 2 / self.sigmas[lumi] ** 2
+        return grad, hessian
+
+    def fit(self, signal, data, auxdata, par_bounds, maxiter=100, tolerance=1e-8):
+        """
+        Minimize twice the NLL for every point with a projected Newton method.
+        Parameters with equal lower and upper bound are held fixed.
+
+        Returns:
+            Tuple of the best-fit parameters and the minimized objective per point.
+        """
+        lo, hi = par_bounds[..., 0], par_bounds[..., 1]
+        pars = np.clip(np.broadcast_to(self.init_pars, lo.shape), lo, hi)
+        nll = self.twice_nll(pars, signal, data, auxdata)
+        active = np.ones(len(pars), dtype=bool)
+
+        for _ in range(maxiter):
+            grad, hessian = self.derivatives(pars, signal, data, auxdata)
+            blocked = (
+                (lo >= hi) | ((pars <= lo) & (grad > 0)) | ((pars >= hi) & (grad < 0))
+            )
+            grad = np.where(blocked, 0.0, grad)
+            active &= np.abs(grad).max(axis=1) > tolerance
+            if not active.any():
+                break
+
+            # Newton step in the free parameters, with the curvature made
+            # positive where the rates are far from the data
+            hessian[blocked] = 0.0
+            hessian.transpose(0, 2, 1)[blocked] = 0.0
+            diagonal = np.arange(3)
+            hessian[:, diagonal, diagonal] = np.where(
+                blocked, 1.0, hessian[:, diagonal, diagonal]
+            )
+            eigenvalues, eigenvectors = np.linalg.eigh(hessian)
+            eigenvalues = np.maximum(np.abs(eigenvalues), 1e-8)
+            direction = -np.einsum(
+                "pik,pk,pjk,pj->pi", eigenvectors, 1.0 / eigenvalues, eigenvectors, grad
+            )
+            direction[blocked] = 0.0
+
+            previous_nll = nll.copy()
+            step_size = np.ones(len(pars))
+            pending = active.copy()
+            for _ in range(40):
+                trial = np.clip(pars + step_size[:, None] * direction, lo, hi)
+                trial_nll = self.twice_nll(trial, signal, data, auxdata)
+                decrease = np.einsum("pi,pi->p", grad, trial - pars)
+                accept = pending & (trial_nll <= nll + 1e-4 * decrease)
+                pars[accept], nll[accept] = trial[accept], trial_nll[accept]
+                pending &= ~accept
+                if not pending.any():
+                    break
+                step_size[pending] *= 0.5
+            # points without any (significant) improvement have converged
+            active &= ~pending & (previous_nll - nll > 1e-10)
+
+        return pars, nll
+
+    def _qmu(self, mu, signal, data, auxdata, minimum=None):
+        n_points = len(signal)
+        par_bounds = np.tile(self.par_bounds, (n_points, 1, 1))
+        fixed_bounds = par_bounds.copy()
+        fixed_bounds[:, poi] = mu[:, None]
+        _, fixed_nll = self.fit(signal, data, auxdata, fixed_bounds)
+        if minimum is None:
+            free_pars, free_nll = self.fit(signal, data, auxdata, par_bounds)
+        else:
+            free_pars, free_nll = minimum, self.twice_nll(
+                minimum, signal, data, auxdata
+            )
+        qmu = np.clip(fixed_nll - free_nll, 0.0, None)
+        return np.where(free_pars[:, poi] > mu, 0.0, qmu)
+
+    def background_fit(self):
+        """
+        Conditional fit at mu=0, which is the same for all signals, i.e. the
+        parameters of the background-only Asimov dataset.
+        """
+        par_bounds = self.par_bounds.copy()[None]
+        par_bounds[:, poi] = 0.0
+        pars, _ = self.fit(
+            np.zeros((1, self.n_bins)), self.data[None], self.auxdata[None], par_bounds
+        )
+        return pars[0]
+
+    def best_fit(self, signal):
+        """
+        Unconditional fits to the observed data for all signals.
+        """
+        n_points = len(signal)
+        pars, _ = self.fit(
+            signal,
+            np.broadcast_to(self.data, signal.shape),
+            np.broadcast_to(self.auxdata, (n_points, 3)),
+            np.tile(self.par_bounds, (n_points, 1, 1)),
+        )
+        return pars
+
+    def hypotest(
+        self,
+        poi_test,
+        signal,
+        qtilde=True,
+        asimov_pars=None,
+        minimum=None,
+        expected_only=False,
+    ):
+        """
+        Equivalent of ``pyhf.infer.hypotest(..., return_expected_set=True)``
+        for all signals at once, ``poi_test`` can hold one value per signal.
+        The background-only fit is done once, or taken from ``asimov_pars``,
+        and the unconditional fit to the Asimov dataset is skipped as its
+        minimum is at ``asimov_pars``. The unconditional fits to the observed
+        data are skipped if their best-fit parameters are passed as
+        ``minimum``. With ``expected_only``, only the expected CLs band is
+        computed and the observed CLs is None.
+
+        Returns:
+            Tuple of observed CLs, shape (n_points,), and expected CLs band as
+            a list of five arrays of shape (n_points,).
+        """
+        n_points = len(signal)
+        mu = np.broadcast_to(np.asarray(poi_test, dtype=float), (n_points,))
+        data = np.broadcast_to(self.data, signal.shape)
+        auxdata = np.broadcast_to(self.auxdata, (n_points, 3))
+        qmu = None
+        if not expected_only:
+            qmu = self._qmu(mu, signal, data, auxdata, minimum=minimum)
+
+        if asimov_pars is None:
+            asimov_pars = self.background_fit()
+        asimov_pars = np.tile(asimov_pars, (n_points, 1))
+        asimov_data = self.expected_data(asimov_pars, signal)
+        qmu_A = self._qmu(mu, signal, asimov_data, asimov_pars, minimum=asimov_pars)
+        return asymptotic_cls(qmu, qmu_A, qtilde=qtilde)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import re
+
+import numpy as np
+
+import pyhf
+
+from helpers.signalTemplate import scaling_modifiers, swappable_rates
+
+data_path_pattern = re.compile("^/channels/([0-9]+)/samples/([0-9]+)/data/([0-9]+)$")
+
+
+def compile_targets(spec, paths, workspace, pdf):
+    """
+    Compile the JSON pointers ``paths`` to single bins of sample rates in
+    ``spec`` into (sample, bin) indices of the nominal rates of ``pdf``, built
+    from the pruned ``workspace``. Targets in pruned channels or samples are
+    None. Returns None if a path is not a single bin or its sample has
+    modifiers that depend on its rates.
+    """
+    targets = []
+    for path in paths:
+        match = data_path_pattern.match(path)
+        if not match:
+            return None
+        channel = spec["channels"][int(match.group(1))]
+        sample = channel["samples"][int(match.group(2))]
+        pruned_sample = next(
+            (
+                pruned_sample
+                for pruned_channel in workspace["channels"]
+                if pruned_channel["name"] == channel["name"]
+                for pruned_sample in pruned_channel["samples"]
+                if pruned_sample["name"] == sample["name"]
+            ),
+            None,
+        )
+        if pruned_sample is None:
+            targets.append(None)
+            continue
+        if any(
+            modifier["type"] not in scaling_modifiers
+            for modifier in pruned_sample["modifiers"]
+        ):
+            return None
+        targets.append(
+            (
+                pdf.config.samples.index(sample["name"]),
+                pdf.config.channel_slices[channel["name"]].start + int(match.group(3)),
+            )
+        )
+    return targets
+
+
+class TruthTemplate:
+    """
+    A pruned pyhf model built once for all truth points, whose signal yields
+    are replaced by a single array assignment into its nominal rates, instead
+    of patching the spec and building a model per point.
+
+    ``compile`` takes the JSON pointers of the yields in the spec, in the
+    order in which ``set_yields`` takes them, and returns None if they cannot
+    be replaced in a built model, e.g. with a backend other than numpy (see
+    ``helpers.signalTemplate.swappable_rates``).
+    """
+
+    def __init__(self, workspace, pdf, targets):
+        self.pdf = pdf
+        self.data = workspace.data(pdf)
+        kept = [target is not None for target in targets]
+        self.kept = np.flatnonzero(kept)
+        self.samples = np.array(
+            [target[0] for target in targets if target is not None], dtype=int
+        )
+        self.bins = np.array(
+            [target[1] for target in targets if target is not None], dtype=int
+        )
+
+    @classmethod
+    def compile(cls, spec, paths, prune, modifier_settings):
+        if not swappable_rates():
+            return None
+        workspace = pyhf.Workspace(spec).prune(**prune)
+        pdf = workspace.model(modifier_settings=modifier_settings)
+        targets = compile_targets(spec, paths, workspace, pdf)
+        if targets is None:
+            return None
+        return cls(workspace, pdf, targets)
+
+    def set_yields(self, yields):
+        nominal_rates = self.pdf.main_model._nominal_rates
+        yields = np.asarray(yields, dtype=float)[self.kept]
+        nominal_rates[0, self.samples, :, self.bins] = yields[:, np.newaxis]
+        self.pdf.main_model._precompute()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import io
+import os
+import pathlib
+import pickle
+
+import numpy as np
+import pandas as pd
+import pyhf
+
+
+def read_truth_files(filenames, points, dsids):
+    """
+    All truth files in a single table with the columns point, dsid, sr, eff
+    and err, where ``points`` and ``dsids`` are those of the files. The files
+    are joined without their headers and parsed by a single ``read_csv``, as
+    the overhead per call dominates for small files.
+    """
+    lines = []
+    n_rows = []
+    for filename in filenames:
+        with open(filename) as truth_file:
+            next(truth_file, None)  # skip header
+            rows = [line.strip() for line in truth_file if line.strip()]
+        lines += rows
+        n_rows.append(len(rows))
+    if not lines:
+        return pd.DataFrame(columns=["point", "dsid", "sr", "eff", "err"])
+
+    table = pd.read_csv(
+        io.StringIO("\n".join(lines)),
+        header=None,
+        usecols=[0, 2, 3],
+        dtype={0: str, 2: float, 3: float},
+        skipinitialspace=True,
+    ).rename(columns={0: "sr", 2: "eff", 3: "err"})
+    table.insert(0, "dsid", np.repeat(dsids, n_rows))
+    table.insert(0, "point", np.repeat(points, n_rows))
+    return table
+
+
+def aggregate_yields(table, xsecs):
+    """
+    Yields and their statistical errors per (point, sr) for a luminosity of 1,
+    summing xsec * eff over the DSIDs of a point and adding xsec * err in
+    quadrature. ``xsecs`` maps the DSIDs of ``table`` to their cross-section
+    times filter efficiency. Points and SRs keep the order of the files.
+    """
+    xsec = table["dsid"].map(xsecs).to_numpy(dtype=float)
+    terms = pd.DataFrame(
+        {
+            "point": table["point"],
+            "sr": table["sr"],
+            "events": xsec * table["eff"].to_numpy(),
+            "variance": (xsec * table["err"].to_numpy()) ** 2,
+        }
+    )
+    yields = terms.groupby(["point", "sr"], sort=False).sum().reset_index()
+    yields["error"] = np.sqrt(yields.pop("variance"))
+    return yields
+
+
+def truth_yields(filenames, points, dsids, xsecs, cache=None):
+    """
+    The table of ``aggregate_yields`` of the truth files, read from ``cache``
+    if none of the files (by size and modification time) nor their
+    cross-sections changed since it was stored, so that e.g. a different
+    luminosity does not parse the files again.
+    """
+    stats = [os.stat(filename) for filename in filenames]
+    key = pyhf.utils.digest(
+        {
+            "files": [
+                [str(filename), stat.st_size, stat.st_mtime_ns]
+                for filename, stat in zip(filenames, stats)
+            ],
+            "xsecs": [float(xsecs[dsid]) for dsid in dsids],
+        }
+    )
+    if cache is not None and cache.exists():
+        try:
+            with cache.open("rb") as cache_file:
+                cached = pickle.load(cache_file)
+            if cached["key"] == key:
+                return cached["yields"]
+        except Exception:
+            pass
+
+    yields = aggregate_yields(read_truth_files(filenames, points, dsids), xsecs)
+    if cache is not None:
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        partial = cache.with_name(f".{cache.name}.{os.getpid()}.partial")
+        with partial.open("wb") as cache_file:
+            pickle.dump(
+                {"key": key, "yields": yields},
+                cache_file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(partial, cache)
+    return yields
+
+
+def truth_cache_path(group):
+    return pathlib.Path(f"analyses/{group}/cache/truth_yields.pkl")
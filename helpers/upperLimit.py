@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from helpers.inference import (
+    batched_hypotest,
+    batched_reference_fits,
+    hypotest,
+    point_results,
+    reference_fits,
+)
+from helpers.simplifiedEngine import poi
+
+# signal strengths of the first scan, relative to the upper bound of the POI
+initial_grid = np.geomspace(1e-3, 1.0, 7)
+
+
+def _crossing(mu_lo, cls_lo, mu_hi, cls_hi, level):
+    """
+    Signal strength at which log(CLs), interpolated linearly between the two
+    ends of a bracket, crosses ``level``.
+    """
+    # open brackets (mu_hi = inf) and CLs = 0 give inf or nan, they are masked later
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_lo, log_hi = np.log(cls_lo), np.log(cls_hi)
+        fraction = (log_lo - np.log(level)) / np.where(
+            log_lo > log_hi, log_lo - log_hi, 1.0
+        )
+        return mu_lo + np.clip(fraction, 0.0, 1.0) * (mu_hi - mu_lo)
+
+
+def upper_limits(
+    evaluate, n_points, mu_max, level=0.05, rtol=1e-3, cls_rtol=1e-3, maxiter=30
+):
+    """
+    Observed and expected upper limits on the signal strength of ``n_points``
+    points at once, i.e. where their CLs values cross ``level``.
+
+    ``evaluate(points, mus)`` returns the observed CLs and the expected CLs
+    band (a list of five arrays) for the points with the indices ``points``
+    at the signal strengths ``mus``, as arrays of equal length, so that all
+    points and signal strengths of a step are evaluated in a single call.
+
+    All six CLs curves of a point are bracketed by a coarse scan first and
+    then refined by interpolating log(CLs), where every evaluation narrows
+    the brackets of all curves of its point. A curve has converged once its
+    bracket is narrower than ``rtol`` or the CLs value at one of its ends is
+    within ``cls_rtol`` of ``level``. Limits above ``mu_max`` are None, and so
+    are the observed ones if ``evaluate`` returns None as the observed CLs.
+
+    Returns:
+        List of (observed limit, list of five expected limits) per point.
+    """
+    shape = (n_points, 6)
+    mu_lo, cls_lo = np.zeros(shape), np.ones(shape)
+    mu_hi, cls_hi = np.full(shape, np.inf), np.zeros(shape)
+
+    def update(points, mus):
+        obsCLs, expCLs = evaluate(points, mus)
+        if obsCLs is None:
+            # never bracketed, so the observed limit is None
+            obsCLs = np.full(len(mus), np.nan)
+        values = np.column_stack([obsCLs, *expCLs])
+        for point, mu, cls in zip(points, mus, values):
+            above = (cls >= level) & (mu > mu_lo[point])
+            mu_lo[point] = np.where(above, mu, mu_lo[point])
+            cls_lo[point] = np.where(above, cls, cls_lo[point])
+            below = (cls < level) & (mu < mu_hi[point])
+            mu_hi[point] = np.where(below, mu, mu_hi[point])
+            cls_hi[point] = np.where(below, cls, cls_hi[point])
+
+    grid = mu_max * initial_grid
+    update(np.repeat(np.arange(n_points), len(grid)), np.tile(grid, n_points))
+
+    for _ in range(maxiter):
+        with np.errstate(divide="ignore"):
+            close = np.minimum(
+                np.abs(np.log(cls_lo / level)), np.abs(np.log(cls_hi / level))
+            )
+        pending = (
+            np.isfinite(mu_hi) & (mu_hi - mu_lo > rtol * mu_hi) & (close > cls_rtol)
+        )
+        if not pending.any():
+            break
+        # interpolate, but keep away from the ends so that the brackets shrink
+        width = np.where(pending, mu_hi - mu_lo, 0.0)
+        proposal = np.clip(
+            _crossing(mu_lo, cls_lo, mu_hi, cls_hi, level),
+            mu_lo + 0.05 * width,
+            mu_hi - 0.05 * width,
+        )
+        points, curves = np.nonzero(pending)
+        update(points, proposal[points, curves])
+
+    limits = np.where(
+        np.isfinite(mu_hi), _crossing(mu_lo, cls_lo, mu_hi, cls_hi, level), np.nan
+    )
+    return [
+        (
+            None if np.isnan(row[0]) else float(row[0]),
+            [None if np.isnan(limit) else float(limit) for limit in row[1:]],
+        )
+        for row in limits
+    ]
+
+
+def _split(results):
+    obsCLs = None
+    if results[0][0] is not None:
+        obsCLs = np.array([float(result[0]) for result in results])
+    expCLs = [np.array([float(result[1][i]) for result in results]) for i in range(5)]
+    return obsCLs, expCLs
+
+
+def model_evaluator(data, pdf, asimov_pars=None, expected_only=False):
+    """
+    ``evaluate(points, mus)`` of a single model and the upper bound of its POI.
+    The unconditional fit to the observed data and the background-only fit
+    are done once and reused at every signal strength.
+    """
+    best_pars, asimov_pars = reference_fits(
+        data, pdf, asimov_pars=asimov_pars, expected_only=expected_only
+    )
+
+    def evaluate(points, mus):
+        return _split(
+            [
+                hypotest(
+                    mu,
+                    data,
+                    pdf,
+                    init_pars=best_pars,
+                    asimov_pars=asimov_pars,
+                    minimum=best_pars,
+                    expected_only=expected_only,
+                )[:2]
+                for mu in mus
+            ]
+        )
+
+    return evaluate, pdf.config.suggested_bounds()[pdf.config.poi_index][1]
+
+
+def batched_evaluator(template, patches, asimov_pars=None, expected_only=False):
+    """
+    ``evaluate(points, mus)`` of ``patches`` in a batched signal template, with
+    one signal strength per batch slot, so that each batch evaluates several
+    points and signal strengths at once.
+    """
+    pdf = template.pdf
+    template.set_signals(patches)
+    best_pars, asimov_pars = batched_reference_fits(
+        template.data, pdf, asimov_pars=asimov_pars, expected_only=expected_only
+    )
+
+    def evaluate(points, mus):
+        results = []
+        for start in range(0, len(points), pdf.batch_size):
+            slots = points[start : start + pdf.batch_size]
+            padding = pdf.batch_size - len(slots)
+            template.set_signals([patches[point] for point in slots])
+            slots = np.concatenate([slots, np.repeat(slots[-1:], padding)])
+            obsCLs, expCLs = batched_hypotest(
+                np.pad(mus[start : start + pdf.batch_size], (0, padding), "edge"),
+                template.data,
+                pdf,
+                asimov_pars=asimov_pars[slots],
+                minimum=None if expected_only else best_pars[slots],
+                expected_only=expected_only,
+            )
+            results += point_results(obsCLs, expCLs, pdf.batch_size - padding)
+        return _split(results)
+
+    return evaluate, pdf.config.suggested_bounds()[pdf.config.poi_index][1]
+
+
+def engine_evaluator(engine, signal, expected_only=False):
+    """
+    ``evaluate(points, mus)`` of the signals of a simplified engine, every call
+    evaluates all its points at once.
+    """
+    asimov_pars = engine.background_fit()
+    best_pars = None if expected_only else engine.best_fit(signal)
+
+    def evaluate(points, mus):
+        return engine.hypotest(
+            mus,
+            signal[points],
+            asimov_pars=asimov_pars,
+            minimum=None if expected_only else best_pars[points],
+            expected_only=expected_only,
+        )
+
+    return evaluate, engine.par_bounds[poi][1]
+
+
+def model_upper_limits(data, pdf, asimov_pars=None, expected_only=False):
+    """
+    Upper limits of a single model.
+    """
+    evaluate, mu_max = model_evaluator(
+        data, pdf, asimov_pars=asimov_pars, expected_only=expected_only
+    )
+    return upper_limits(evaluate, 1, mu_max)[0]
+
+
+def batched_upper_limits(template, patches, asimov_pars=None, expected_only=False):
+    """
+    Upper limits of ``patches`` in a batched signal template.
+    """
+    evaluate, mu_max = batched_evaluator(
+        template, patches, asimov_pars=asimov_pars, expected_only=expected_only
+    )
+    return upper_limits(evaluate, len(patches), mu_max)
+
+
+def engine_upper_limits(engine, signal, expected_only=False):
+    """
+    Upper limits of all signals of a simplified engine, every step evaluates
+    all points that have not converged at once.
+    """
+    evaluate, mu_max = engine_evaluator(engine, signal, expected_only=expected_only)
+    return upper_limits(evaluate, len(signal), mu_max)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from helpers.inference import pars_by_name, pars_from_names
+
+
+def mass_order(patches):
+    """
+    Sort patches by their signal point ``values``, so that consecutive fits are
+    neighbours in mass space.
+    """
+    return sorted(patches, key=lambda patch: tuple(patch.values))
+
+
+class WarmStart:
+    """
+    Best-fit parameters of completed points, used to seed the fit of the next
+    point with those of its nearest completed neighbour in mass space.
+
+    Parameters are matched by name, so that points whose models differ in some
+    (e.g. signal) parameters can still seed each other.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.best_fits = []
+
+    def init_pars(self, values, pdf):
+        init_pars = list(pdf.config.suggested_init())
+        if not self.values:
+            return init_pars
+
+        distances = np.linalg.norm(
+            np.asarray(self.values, dtype=float) - np.asarray(values, dtype=float),
+            axis=1,
+        )
+        best_fit = self.best_fits[int(np.argmin(distances))]
+        return pars_from_names(pdf, best_fit)
+
+    def add(self, values, pdf, best_pars):
+        self.values.append(tuple(values))
+        self.best_fits.append(pars_by_name(pdf, best_pars))
@@ -1,12 +1,24 @@
 #!/usr/bin/env python
 
+import hashlib
 import os
+import pickle
+import numpy as np
 import pandas as pd
 
 
 class CrossSectionDB:
     """
     A class for getting cross-sections (and filter efficiencies) from the central PMG xsec database.
+
+    The parsed table is kept as a pickled snapshot (by default in
+    ``~/.cache/xsecDB``), which is used as long as size and modification time
+    of the source file are unchanged, or if the source is not available at all
+    (e.g. on nodes without cvmfs). Rows are indexed by DSID and (DSID, etag).
+
+    The plural methods (``xsecs``, ``efficiencies``, ...) look up arrays of
+    DSIDs at once and return NumPy arrays together with a mask of the DSIDs
+    that are not in the database, whose values are NaN.
     """
 
     db = pd.DataFrame()
@@ -27,39 +39,120 @@ class CrossSectionDB:
             "etag",
         ],
         separator="\t\t",
+        snapshot=None,
     ):
 
         self.filename = filename
         self.dirname = dirname
-
-        self.db = pd.read_csv(
-            os.path.join(dirname, filename),
-            sep=separator,
-            skiprows=1,
-            header=None,
-            names=columns,
+        path = os.path.abspath(os.path.join(dirname, filename))
+        # snapshots of files with the same name in different places must not mix
+        self.snapshot = snapshot or os.path.join(
+            os.path.expanduser("~"),
+            ".cache",
+            "xsecDB",
+            hashlib.sha1(path.encode()).hexdigest()[:12] + "_" + filename + ".pkl",
         )
 
-    def getMatch(self, field, dsid, etag=None):
-        dsid = int(dsid)
+        stamp = None
+        if os.path.exists(path):
+            stat = os.stat(path)
+            stamp = [path, stat.st_size, stat.st_mtime_ns]
+
+        self.db = self._load_snapshot(stamp)
+        if self.db is None:
+            self.db = self._parse(path, columns, separator)
+            self._write_snapshot(stamp)
+
+        self._index()
+
+    @staticmethod
+    def _parse(path, columns, separator):
+        """
+        Read the table, splitting a separator that repeats a single character
+        (the default double tab) at that character, so that the C parser can
+        be used instead of the much slower regex one, and keeping every n-th
+        column, as the others are the empty fields between the repeats.
+        """
+        if len(set(separator)) != 1:
+            return pd.read_csv(
+                path, sep=separator, skiprows=1, header=None, names=columns
+            )
+        step = len(separator)
+        db = pd.read_csv(path, sep=separator[0], skiprows=1, header=None)
+        db = db.iloc[:, : len(columns) * step : step]
+        db.columns = columns
+        return db
+
+    def _load_snapshot(self, stamp):
+        if not os.path.exists(self.snapshot):
+            return None
         try:
-            if etag:
-                mask = (self.db["dataset_number"] == dsid) & (self.db["etag"] == etag)
-            else:
-                mask = (self.db["dataset_number"] == dsid)
-            df = self.db.loc[mask, :]
-        except Exception as e: # work on python 3.x
-            print('Failed to get value: '+ str(e))
+            with open(self.snapshot, "rb") as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+        except Exception:
+            return None
+        # without the source, any snapshot is better than nothing
+        if stamp is not None and snapshot["stamp"] != stamp:
             return None
+        return snapshot["db"]
+
+    def _write_snapshot(self, stamp):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot), exist_ok=True)
+            partial = f"{self.snapshot}.{os.getpid()}.partial"
+            with open(partial, "wb") as snapshot_file:
+                pickle.dump(
+                    {"stamp": stamp, "db": self.db},
+                    snapshot_file,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(partial, self.snapshot)
+        except OSError as e:
+            print("Failed to write snapshot: " + str(e))
+
+    def _index(self):
+        """
+        Row numbers of every DSID and of every (DSID, etag), in file order.
+        """
+        self.columns = {name: self.db[name].to_numpy() for name in self.db.columns}
+        self.rows = {}
+        self.etag_rows = {}
+        for row, (dsid, etag) in enumerate(
+            zip(self.columns["dataset_number"].tolist(), self.columns["etag"].tolist())
+        ):
+            self.rows.setdefault(dsid, []).append(row)
+            self.etag_rows.setdefault((dsid, etag), []).append(row)
+        # first rows and number of rows per DSID, as Series for bulk lookups
+        self.first_rows = pd.Series(
+            {dsid: rows[0] for dsid, rows in self.rows.items()}, dtype=float
+        )
+        self.row_counts = pd.Series(
+            {dsid: len(rows) for dsid, rows in self.rows.items()}, dtype=float
+        )
+        self.first_etag_rows = pd.Series(
+            {key: rows[0] for key, rows in self.etag_rows.items()}, dtype=float
+        )
 
-        if len(df.index) > 1:
+    def getRow(self, dsid, etag=None):
+        dsid = int(dsid)
+        if etag:
+            rows = self.etag_rows.get((dsid, etag), [])
+        else:
+            rows = self.rows.get(dsid, [])
+
+        if not rows:
+            raise KeyError("No row with DSID " + str(dsid) + " found!")
+        if len(rows) > 1:
             print(
                 "More than one row with DSID "
                 + str(dsid)
                 + " found! Picking first one ..."
             )
 
-        return df[field].values[0]
+        return rows[0]
+
+    def getMatch(self, field, dsid, etag=None):
+        return self.columns[field][self.getRow(dsid, etag)]
 
     def xsec(self, dsid, etag=None):
         return self.getMatch("crossSection", dsid, etag)
@@ -72,12 +165,78 @@ class CrossSectionDB:
 
     def xsecTimesEff(self, dsid, etag=None):
         try:
-            return self.xsec(dsid, etag) * self.efficiency(dsid, etag)
+            row = self.getRow(dsid, etag)
+            return self.columns["crossSection"][row] * self.columns["genFiltEff"][row]
         except:
             return None
 
     def xsecTimesEffTimeskFac(self, dsid, etag=None):
         try:
-            return self.xsec(dsid, etag) * self.efficiency(dsid, etag) * self.kFactor(dsid, etag)
+            row = self.getRow(dsid, etag)
+            return (
+                self.columns["crossSection"][row]
+                * self.columns["genFiltEff"][row]
+                * self.columns["kFactor"][row]
+            )
         except:
             return None
+
+    def getRows(self, dsids, etags=None):
+        """
+        Row numbers of many DSIDs at once, picking the first row of every DSID
+        like ``getRow``. Entries of ``etags`` that are empty or None match any
+        etag.
+
+        Returns:
+            Tuple of the row numbers and the mask of DSIDs without a row, whose
+            row numbers are 0.
+        """
+        dsids = np.asarray(dsids).astype(np.int64)
+        rows = self.first_rows.reindex(dsids).to_numpy(dtype=float)
+        tagged = np.zeros(len(dsids), dtype=bool)
+        if etags is not None:
+            etags = np.asarray(etags, dtype=object)
+            tagged = np.array([bool(etag) for etag in etags], dtype=bool)
+            if tagged.any():
+                rows[tagged] = self.first_etag_rows.reindex(
+                    pd.MultiIndex.from_arrays([dsids[tagged], etags[tagged]])
+                ).to_numpy(dtype=float)
+
+        counts = self.row_counts.reindex(dsids[~tagged]).to_numpy(dtype=float)
+        duplicates = np.unique(dsids[~tagged][counts > 1])
+        if len(duplicates):
+            print(
+                "More than one row found for "
+                + str(len(duplicates))
+                + " DSID(s)! Picking first ones ..."
+            )
+
+        missing = np.isnan(rows)
+        return np.where(missing, 0, rows).astype(np.int64), missing
+
+    def getMatches(self, field, dsids, etags=None):
+        rows, missing = self.getRows(dsids, etags)
+        return np.where(missing, np.nan, self.columns[field][rows]), missing
+
+    def xsecs(self, dsids, etags=None):
+        return self.getMatches("crossSection", dsids, etags)
+
+    def efficiencies(self, dsids, etags=None):
+        return self.getMatches("genFiltEff", dsids, etags)
+
+    def kFactors(self, dsids, etags=None):
+        return self.getMatches("kFactor", dsids, etags)
+
+    def xsecsTimesEff(self, dsids, etags=None):
+        rows, missing = self.getRows(dsids, etags)
+        values = self.columns["crossSection"][rows] * self.columns["genFiltEff"][rows]
+        return np.where(missing, np.nan, values), missing
+
+    def xsecsTimesEffTimeskFac(self, dsids, etags=None):
+        rows, missing = self.getRows(dsids, etags)
+        values = (
+            self.columns["crossSection"][rows]
+            * self.columns["genFiltEff"][rows]
+            * self.columns["kFactor"][rows]
+        )
+        return np.where(missing, np.nan, values), missing
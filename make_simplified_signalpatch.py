@@ -6,6 +6,8 @@ import json
 import numpy as np
 import pyhf
 
+from helpers.patchsetIndex import PatchsetIndex
+
 pattern = re.compile("(\d+(?:p[05])?)_(\d+(?:p[05])?)")
 
 
@@ -49,8 +51,8 @@ def main(group, likelihood, patchset, output_file, signal_uncertainties):
             open(pathlib.Path(f"./analyses/{group}/likelihoods/{likelihood}"), "r")
         )
     )
-    _patchset = pyhf.PatchSet(
-        json.load(open(pathlib.Path(f"./analyses/{group}/likelihoods/{patchset}"), "r"))
+    _patchset = PatchsetIndex(
+        pathlib.Path(f"./analyses/{group}/likelihoods/{patchset}")
     )
 
     simplified_patchset = {}
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+import json
+import click
+
+import harvest
+from helpers.clsCurve import rescale_result
+from helpers.resultStore import ResultStore, store_path
+
+
+def point_factors(records, up, down, factors):
+    """
+    Signal scale factors of every record, from ``factors`` (record name to
+    {"Up": ..., "Down": ...}) or else the global ``up`` and ``down``.
+    """
+    scales = {}
+    for record in records:
+        scale = factors.get(record["name"], {})
+        scales[record["name"]] = {
+            "Up": scale.get("Up", up),
+            "Down": scale.get("Down", down),
+        }
+        if None in scales[record["name"]].values():
+            raise click.ClickException(
+                f"No scale factors for {record['name']}, use --up/--down or --factors"
+            )
+    return scales
+
+
+@click.command()
+@click.option(
+    "--group",
+    default="1Lbb",
+    type=click.Choice(
+        [
+            "compressed",
+            "1Lbb",
+            "2L0J",
+            "3Loffshell",
+            "stop1L",
+        ]
+    ),
+)
+@click.option("--include", default=None)
+@click.option("--simplified/--no-simplified", default=False)
+@click.option(
+    "--up",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Signal scale factor of the Up variation, e.g. 1 + the relative cross-section uncertainty",
+)
+@click.option(
+    "--down",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Signal scale factor of the Down variation",
+)
+@click.option(
+    "--factors",
+    default=None,
+    type=click.Path(exists=True, dir_okay=False),
+    help='JSON file of per-point scale factors, {"<result name>": {"Up": 1.12, "Down": 0.88}}',
+)
+@click.option(
+    "--nominal-label",
+    default="Nominal",
+    help="Label of the nominal harvest, as --nominalLabel of harvestToContours.py",
+)
+def main(group, include, simplified, up, down, factors, nominal_label):
+    store = ResultStore(store_path(group))
+    records = harvest.matching_records(
+        store, harvest.harvest_wildcard(include, simplified)
+    )
+    without_curve = [record["name"] for record in records if "curve" not in record]
+    if without_curve:
+        raise click.ClickException(
+            f"{len(without_curve)} result(s) have no CLs curve, run with --cls-curves: {' '.join(without_curve[:5])}{' ...' if len(without_curve) > 5 else ''}"
+        )
+
+    scales = point_factors(
+        records, up, down, json.load(open(factors, "r")) if factors else {}
+    )
+    variations = {nominal_label: records}
+    for label in ["Up", "Down"]:
+        variations[label] = []
+        for record in records:
+            try:
+                variations[label].append(
+                    rescale_result(record, scales[record["name"]][label])
+                )
+            except ValueError as error:
+                raise click.ClickException(f"{record['name']}: {error}")
+
+    for label, variation in variations.items():
+        path = harvest.harvest_path(group, simplified, f"_{label}")
+        harvest.write_harvest(harvest.harvest_records(variation), path)
+        click.echo(f"Wrote {len(variation)} point(s) to {path}")
+
+
+if __name__ == "__main__":
+    main()
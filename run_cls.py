@@ -5,62 +5,138 @@ import re
 import pyhf
 import json
 
-from functools import wraps
-from time import time
+import harvest
+from helpers import parallel
+from helpers.autotune import auto_backend, tuning_path
+from helpers.clsCurve import curve_grid, curve_points, curve_range, signal_scans
+from helpers.costModel import CostModel, model_size, timings_path
+from helpers.modelCache import ModelCache, model_cache_path
+from helpers.inference import hypotest
+from helpers.interimHarvest import InterimHarvest
+from helpers.profiler import profiler, stage, timed
+from helpers.resultCache import ResultCache, cache_path, cls_result
+from helpers.resultStore import ResultStore, store_path
+from helpers.upperLimit import model_evaluator
 
 pattern = re.compile("(\d+(?:p[05])?)_(\d+(?:p[05])?)")
 
-total_time = []
-
-
-def timeit(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        start = time()
-        result = f(*args, **kwargs)
-        end = time()
-        total_time.append((end - start))
-        return result
-
-    return wrapper
-
 
 def string_to_float(string):
     return float(string.replace("p", "."))
 
 
-@timeit
 def create_ws(
     filename, prune_channel, prune_modifier, prune_modifier_type, prune_sample
 ):
-    ws = pyhf.Workspace(json.load(open(pathlib.Path(str(filename)), "r")))
-    ws = ws.prune(
-        modifiers=prune_modifier,
-        modifier_types=prune_modifier_type,
-        samples=prune_sample,
-        channels=prune_channel,
-    )
+    with stage("parse"):
+        ws = pyhf.Workspace(json.load(open(pathlib.Path(str(filename)), "r")))
+    with stage("prune"):
+        ws = ws.prune(
+            modifiers=prune_modifier,
+            modifier_types=prune_modifier_type,
+            samples=prune_sample,
+            channels=prune_channel,
+        )
     return ws
 
 
-@timeit
+modifier_settings = {
+    "normsys": {"interpcode": "code4"},
+    "histosys": {"interpcode": "code4p"},
+}
+
+
+@timed("build_model")
+def build_pdf(ws):
+    return ws.model(modifier_settings=modifier_settings)
+
+
 def create_pdf(ws):
-    return ws.model(
-        modifier_settings={
-            "normsys": {"interpcode": "code4"},
-            "histosys": {"interpcode": "code4p"},
-        }
+    model_cache = parallel.shared.get("model_cache")
+    if model_cache is None:
+        return build_pdf(ws)
+    return model_cache.model(
+        ws, lambda: build_pdf(ws), modifier_settings=modifier_settings
     )
 
 
-@timeit
+@timed("hypotest")
 def run_fit(ws, pdf):
+    if parallel.shared["expected_only"]:
+        obsCLs, expCLs, _ = hypotest(
+            1.0, ws.data(pdf), pdf, qtilde=True, expected_only=True
+        )
+        return (obsCLs, expCLs)
     obsCLs, expCLs = pyhf.infer.hypotest(
         1.0, ws.data(pdf), pdf, qtilde=True, return_expected_set=True
     )
     return (obsCLs, expCLs)
 
 
+def run_signal_scans(ws, pdf):
+    expected_only = parallel.shared["expected_only"]
+    evaluate, mu_max = model_evaluator(ws.data(pdf), pdf, expected_only=expected_only)
+    return signal_scans(
+        evaluate,
+        1,
+        mu_max,
+        limits=parallel.shared["upper_limits"],
+        curves=parallel.shared["cls_curves"],
+        observed=not expected_only,
+        grid=parallel.shared["curve_grid"],
+    )[0]
+
+
+def tune_backend(group, filenames, prunes, optimizer, n_points):
+    """
+    Fastest consistent backend and optimizer for the workspaces, from an
+    earlier run or timed on ``n_points`` of them spread over the grid.
+    """
+    step = max(1, len(filenames) // n_points)
+    points = sorted(filenames)[::step][:n_points]
+
+    def evaluate(filename):
+        ws = create_ws(filename, *prunes)
+        pdf = ws.model(modifier_settings=modifier_settings)
+        obsCLs, expCLs = pyhf.infer.hypotest(
+            1.0, ws.data(pdf), pdf, qtilde=True, return_expected_set=True
+        )
+        return [obsCLs, *expCLs]
+
+    likelihood = pyhf.utils.digest(
+        [pyhf.utils.digest(json.load(open(filename, "r"))) for filename in points]
+    )
+    return auto_backend(
+        tuning_path(group), likelihood, evaluate, points, optimizer=optimizer
+    )
+
+
+def process_file(filename):
+    with profiler.point(filename.name) as record:
+        ws = create_ws(
+            filename,
+            parallel.shared["prune_channel"],
+            parallel.shared["prune_modifier"],
+            parallel.shared["prune_modifier_type"],
+            parallel.shared["prune_sample"],
+        )
+        pdf = create_pdf(ws)
+        result = run_fit(ws, pdf)
+        extra = {}
+        if parallel.shared["upper_limits"] or parallel.shared["cls_curves"]:
+            extra = run_signal_scans(ws, pdf)
+    return (*result, extra, model_size(ws)), record
+
+
+@timed("write_result")
+def write_result(store, group, simplified, filename, result):
+    match = pattern.search(filename.name)
+    store.append(
+        f"{'simplified_' if simplified else ''}{group}_{match.group(1)}_{match.group(2)}",
+        result,
+    )
+
+
 @click.command()
 @click.option(
     "--group",
@@ -69,7 +145,11 @@ def run_fit(ws, pdf):
 )
 @click.option("--simplified/--no-simplified", default=False)
 @click.option("--benchmark/--no-benchmark", default=False)
-@click.option("--backend", default="pytorch")
+@click.option(
+    "--backend",
+    default="pytorch",
+    help="pyhf backend, or auto to pick the fastest installed one that agrees with numpy",
+)
 @click.option(
     "--prune-channel",
     default=[],
@@ -94,9 +174,94 @@ def run_fit(ws, pdf):
     multiple=True,
     help="Modifier to prune",
 )
-@click.option("--optimizer", default="scipy")
+@click.option("--optimizer", default=None)
 @click.option("--skip-to", default=None)
 @click.option("--include", default=None)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Skip workspaces whose result is already in the cache of the group",
+)
+@click.option(
+    "--trace",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write per-point stage timings, histograms and profiles to this JSON file",
+)
+@click.option(
+    "--profile-slowest",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Run every point under cProfile and keep the profiles of the N slowest",
+)
+@click.option(
+    "--interim-every",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Write an interim harvest every N completed points",
+)
+@click.option(
+    "--interim-seconds",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Write an interim harvest every T seconds",
+)
+@click.option(
+    "--interim-command",
+    default=None,
+    help="Run this in the background after every interim harvest, {harvest} is replaced by its path",
+)
+@click.option(
+    "--upper-limits/--no-upper-limits",
+    default=False,
+    help="Also compute the observed and expected upper limits on mu of every point",
+)
+@click.option(
+    "--cls-curves/--no-cls-curves",
+    default=False,
+    help="Also store the CLs of every point as a function of mu, for rescale.py",
+)
+@click.option(
+    "--curve-range",
+    nargs=2,
+    default=curve_range,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Range of mu of the CLs curves, i.e. of the signal scale factors rescale.py can apply",
+)
+@click.option(
+    "--curve-points",
+    default=curve_points,
+    type=click.IntRange(min=2),
+    help="Number of log-spaced values of mu of the CLs curves",
+)
+@click.option(
+    "--expected-only/--no-expected-only",
+    default=False,
+    help="Only compute the expected CLs band, skipping all fits to the observed data but the one at mu=0",
+)
+@click.option(
+    "--cost-order/--no-cost-order",
+    default=True,
+    help="With several jobs, run the workspaces expected to take longest (from model size and earlier timings) first",
+)
+@click.option(
+    "--model-cache/--no-model-cache",
+    default=True,
+    help="Store the built models on disk and reuse them in later runs",
+)
+@click.option(
+    "--tune-points",
+    default=3,
+    type=click.IntRange(min=1),
+    help="Number of workspaces timed with every backend and optimizer for --backend auto",
+)
 def main(
     group,
     simplified,
@@ -109,15 +274,36 @@ def main(
     optimizer,
     skip_to,
     include,
+    jobs,
+    cache,
+    trace,
+    profile_slowest,
+    interim_every,
+    interim_seconds,
+    interim_command,
+    upper_limits,
+    cls_curves,
+    curve_range,
+    curve_points,
+    expected_only,
+    cost_order,
+    model_cache,
+    tune_points,
 ):
 
-    pyhf.set_backend(backend, optimizer)
+    if backend != "auto":
+        # scipy unless given, --backend auto tries all optimizers instead
+        optimizer = optimizer or "scipy"
+        pyhf.set_backend(backend, optimizer)
+    profiler.profile_slowest = profile_slowest
+    if curve_range[0] >= curve_range[1]:
+        raise click.BadParameter("must be increasing", param_hint="--curve-range")
 
     found = False
     wildcard = "*.json" if not include else include
-    filenames = pathlib.Path(f"./analyses/{group}/workspaces/").glob(wildcard)
+    filenames = []
 
-    for filename in filenames:
+    for filename in pathlib.Path(f"./analyses/{group}/workspaces/").glob(wildcard):
         if not skip_to:
             found = True
         else:
@@ -126,6 +312,102 @@ def main(
                 continue
             if not found:
                 continue
+        assert pattern.search(filename.name)
+        filenames.append(filename)
+
+    if backend == "auto":
+        prunes = (prune_channel, prune_modifier, prune_modifier_type, prune_sample)
+        backend, optimizer = tune_backend(
+            group, filenames, prunes, optimizer, tune_points
+        )
+        pyhf.set_backend(backend, optimizer)
+
+    result_store = ResultStore(store_path(group))
+    result_cache = ResultCache(cache_path(group)) if cache else None
+    keys = {}
+    sizes = {}
+    settings = None
+    if result_cache is not None:
+        settings = {
+            "backend": backend,
+            "optimizer": optimizer,
+            "modifier_settings": modifier_settings,
+            "prune": [prune_channel, prune_modifier, prune_modifier_type, prune_sample],
+        }
+        if upper_limits:
+            settings["upper_limits"] = True
+        if cls_curves:
+            settings["cls_curves"] = {
+                "range": list(curve_range),
+                "points": curve_points,
+            }
+        if expected_only:
+            settings["expected_only"] = True
+    cost_ordered = cost_order and jobs > 1
+    for filename in list(filenames):
+        if result_cache is None and not cost_ordered:
+            break
+        try:
+            spec = json.load(open(filename, "r"))
+            if cost_ordered:
+                sizes[filename] = model_size(spec)
+        except Exception:
+            # left to the worker, which reports it as a failed point
+            continue
+        if result_cache is None:
+            continue
+        key = ResultCache.key(workspace=pyhf.utils.digest(spec), **settings)
+        if key in result_cache:
+            write_result(
+                result_store, group, simplified, filename, result_cache.get(key)
+            )
+            filenames.remove(filename)
+            continue
+        keys[filename] = key
+    if result_cache is not None:
+        click.echo(f"{len(keys)} workspace(s) to run, the others are cached.")
+
+    cost_model = CostModel(timings_path(group))
+    cost = None
+    if cost_ordered:
+
+        def cost(filename):
+            return cost_model.estimate(filename.name, sizes.get(filename, 0))
+
+    interim = None
+    if interim_every or interim_seconds:
+        wildcard = harvest.harvest_wildcard(f"{group}_*.json", simplified)
+        interim = InterimHarvest(
+            lambda: harvest.harvest_records(
+                harvest.matching_records(
+                    map(result_store.get, sorted(result_store.written)), wildcard
+                )
+            ),
+            harvest.write_harvest,
+            harvest.harvest_path(group, simplified, suffix="_interim"),
+            every=interim_every,
+            seconds=interim_seconds,
+            command=interim_command,
+        )
+
+    failed = []
+    for filename, result, error in parallel.run_parallel(
+        process_file,
+        filenames,
+        jobs=jobs,
+        backend=backend,
+        optimizer=optimizer,
+        cost=cost,
+        model_cache=ModelCache(model_cache_path(group)) if model_cache else None,
+        prune_channel=prune_channel,
+        prune_modifier=prune_modifier,
+        prune_modifier_type=prune_modifier_type,
+        prune_sample=prune_sample,
+        upper_limits=upper_limits,
+        cls_curves=cls_curves,
+        curve_grid=curve_grid(*curve_range, curve_points),
+        expected_only=expected_only,
+    ):
         match = pattern.search(filename.name)
         assert match
         masses = string_to_float(match.group(1)), string_to_float(match.group(2))
@@ -133,37 +415,36 @@ def main(
         if not benchmark:
             click.echo(filename)
 
-        try:
-            ws = create_ws(
-                filename,
-                prune_channel,
-                prune_modifier,
-                prune_modifier_type,
-                prune_sample,
-            )
-            pdf = create_pdf(ws)
-            obsCLs, expCLs = run_fit(ws, pdf)
-            with open(
-                pathlib.Path(
-                    f"analyses/{group}/results/{'simplified_' if simplified else ''}{group}_{match.group(1)}_{match.group(2)}.json"
-                ),
-                "w",
-            ) as fp:
-                json.dump(
-                    {
-                        "CLs_exp": [float(i.tolist()) for i in expCLs],
-                        "CLs_obs": obsCLs.tolist(),
-                    },
-                    fp,
-                )
-        except Exception as e:
-            print(e)
+        if error:
+            click.echo(f"Failed {filename}:\n{error}", err=True)
+            failed.append(filename.name)
+            continue
+
+        (obsCLs, expCLs, extra, size), record = result
+        profiler.add(record)
+        cost_model.add(filename.name, record["total"], size)
+        point_result = cls_result(obsCLs, expCLs)
+        point_result.update(extra)
+        write_result(result_store, group, simplified, filename, point_result)
+        if result_cache is not None:
+            result_cache.put(keys[filename], point_result)
+        if interim:
+            interim.completed()
 
-        total_time.insert(0, sum(total_time))
         if benchmark:
-            # print(*total_time, sep = " ")
-            print(total_time[0])
-        total_time.clear()
+            # print(*timings, sep = " ")
+            print(sum(record["stages"].values()))
+
+    if interim:
+        interim.close()
+
+    if failed:
+        click.echo(f"{len(failed)} point(s) failed: {' '.join(failed)}", err=True)
+
+    if benchmark:
+        profiler.print_summary()
+    if trace:
+        profiler.write_trace(trace)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import click
 import copy
+import math
 import pathlib
 import re
 import json
@@ -8,25 +9,53 @@ import jsonpatch
 
 import pyhf
 
-from time import time
-from functools import wraps
-
+import harvest
+from helpers import parallel
+from helpers.autotune import auto_backend, tuning_path
+from helpers.boundaryScheduler import BoundaryScheduler, cls_values
+from helpers.clsCurve import curve_grid, curve_points, curve_range, signal_scans
+from helpers.costModel import CostModel, model_size, timings_path
+from helpers.interimHarvest import InterimHarvest
+from helpers.modelCache import ModelCache, model_cache_path
+from helpers.inference import (
+    background_fit,
+    batched_hypotest,
+    hypotest,
+    pars_from_names,
+    point_results,
+    shared_background_fit,
+)
+from helpers.patchCompiler import InPlacePatch, model_from_spec
+from helpers.patchsetIndex import PatchsetIndex
+from helpers.profiler import print_timings, profiler, stage, timed
+from helpers.resultCache import ResultCache, cache_path, cls_result
+from helpers.resultStore import ResultStore, store_path, sync_records
+from helpers.signalTemplate import (
+    SignalTemplate,
+    shares_background,
+    signal_ops,
+    swappable_rates,
+    template_ops,
+)
+from helpers.simplifiedEngine import SimplifiedEngine, is_simplified
+from helpers.upperLimit import batched_evaluator, engine_evaluator, model_evaluator
+from helpers.warmStart import WarmStart, mass_order
 
 pattern = re.compile("(\d+(?:p[05])?)_(\d+(?:p[05])?)")
 
-total_time = []
+modifier_settings = {
+    "normsys": {"interpcode": "code4"},
+    "histosys": {"interpcode": "code4p"},
+}
 
+# largest CLs difference tolerated between shared and per-point Asimov datasets
+asimov_tolerance = 1e-3
 
-def timeit(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        start = time()
-        result = f(*args, **kwargs)
-        end = time()
-        total_time.append((end - start))
-        return result
+# CLs value of the exclusion contour
+contour_level = 0.05
 
-    return wrapper
+# largest CLs difference tolerated between the simplified engine and pyhf
+engine_tolerance = 1e-3
 
 
 def string_to_float(string):
@@ -69,25 +98,611 @@ def get_only_bin(spec, n):
     }
 
 
-@timeit
-def run_single_point(spec, patch):
-    patched_spec = jsonpatch.apply_patch(spec, patch)
+@timed("apply_patch")
+def apply_patch(spec, patch):
+    return jsonpatch.apply_patch(spec, patch)
+
+
+@timed("build_model")
+def build_model(patched_spec):
     ws = pyhf.Workspace(patched_spec)
     # ws = ws.prune(modifiers=prune_modifier,modifier_types=prune_modifier_type,samples=prune_sample,channels=prune_channel)
-    pdf = ws.model(
-        modifier_settings={
-            "normsys": {"interpcode": "code4"},
-            "histosys": {"interpcode": "code4p"},
-        }
+    pdf = ws.model(modifier_settings=modifier_settings)
+    return ws.data(pdf), pdf
+
+
+@timed("apply_patch")
+def apply_patch_inplace(spec, patch, verify=False):
+    inplace_patch = InPlacePatch(patch.patch)
+    inplace_patch.apply(spec, verify=verify)
+    return inplace_patch
+
+
+@timed("validate_patch")
+def validate_patched(patched_spec):
+    pyhf.utils.validate(patched_spec, "workspace.json")
+
+
+@timed("build_model")
+def build_model_inplace(patched_spec):
+    return model_from_spec(patched_spec, modifier_settings=modifier_settings)
+
+
+@timed("undo_patch")
+def undo_patch(spec, inplace_patch, digest=None):
+    inplace_patch.undo(spec, digest=digest)
+
+
+@timed("build_template")
+def build_template(spec, ops, batch_size=None, model_cache=None):
+    return SignalTemplate(
+        spec, ops, modifier_settings, batch_size=batch_size, model_cache=model_cache
     )
 
+
+@timed("set_signal")
+def set_signal(template, patch):
+    template.set_signal(patch)
+    return template.data, template.pdf
+
+
+@timed("hypotest")
+def run_fit(data, pdf):
     obsCLs, expCLs = pyhf.infer.hypotest(
-        1.0, ws.data(pdf), pdf, qtilde=True, return_expected_set=True
+        1.0, data, pdf, qtilde=True, return_expected_set=True
+    )
+    return (obsCLs, expCLs)
+
+
+@timed("hypotest")
+def run_hypotest(data, pdf, init_pars=None, asimov_pars=None):
+    return hypotest(
+        1.0,
+        data,
+        pdf,
+        init_pars=init_pars,
+        qtilde=True,
+        asimov_pars=asimov_pars,
+        expected_only=parallel.shared.get("expected_only", False),
     )
 
+
+@timed("background_fit")
+def shared_asimov_pars(data, pdf, ops):
+    """
+    Parameters of the background-only Asimov dataset for ``pdf``, taken from
+    the mu=0 fit that is done once per process and background-only spec, or
+    None if the signal of ``ops`` changes that fit.
+    """
+    if not parallel.shared.get("shared_asimov") or not shares_background(ops):
+        return None
+    if parallel.shared.get("background_fit") is None:
+        fit = shared_background_fit if pdf.batch_size else background_fit
+        parallel.shared["background_fit"] = fit(data, pdf)
+    return pars_from_names(pdf, parallel.shared["background_fit"])
+
+
+def tune_backend(group, spec, patchset, optimizer, n_points):
+    """
+    Fastest consistent backend and optimizer for ``spec``, from an earlier run
+    or timed on ``n_points`` patches spread over the patchset.
+    """
+    entries = [entry for entry in patchset.entries if entry.n_ops]
+    step = max(1, len(entries) // n_points)
+    points = [patchset.load(entry) for entry in entries[::step][:n_points]]
+
+    def evaluate(patch):
+        obsCLs, expCLs = run_fit(*build_model(apply_patch(spec, patch)))
+        return [obsCLs, *expCLs]
+
+    return auto_backend(
+        tuning_path(group),
+        pyhf.utils.digest(spec),
+        evaluate,
+        points,
+        optimizer=optimizer,
+    )
+
+
+def cls_difference(result, reference):
+    # expected-only results have no observed CLs to compare
+    pairs = list(zip(result[1], reference[1]))
+    if result[0] is not None:
+        pairs.append((result[0], reference[0]))
+    return max(abs(float(a) - float(b)) for a, b in pairs)
+
+
+def compare_shared_asimov(shared, unshared):
+    difference = cls_difference(shared, unshared)
+    if difference > asimov_tolerance:
+        raise RuntimeError(
+            f"CLs with shared Asimov dataset differ by {difference:.2g} from the per-point result"
+        )
+
+
+def load_model(spec, patch, template=None):
+    if template:
+        data, pdf = set_signal(template, patch)
+    elif parallel.shared.get("inplace"):
+        # patch the shared spec directly and restore it once the model is built
+        verify = parallel.shared.get("verify")
+        # the first patch of every worker is validated as pyhf.Workspace would
+        validate = parallel.shared.get("validate") and not parallel.shared.get(
+            "validated"
+        )
+        digest = pyhf.utils.digest(spec) if verify else None
+        inplace_patch = apply_patch_inplace(spec, patch, verify=verify or validate)
+        try:
+            if validate:
+                validate_patched(spec)
+                parallel.shared["validated"] = True
+            data, pdf = build_model_inplace(spec)
+        finally:
+            undo_patch(spec, inplace_patch, digest=digest)
+    else:
+        data, pdf = build_model(apply_patch(spec, patch))
+    return data, pdf
+
+
+def run_single_point(spec, patch, template=None, warm_start=None):
+    data, pdf = load_model(spec, patch, template=template)
+    asimov_pars = shared_asimov_pars(data, pdf, signal_ops(patch.patch))
+    expected_only = parallel.shared.get("expected_only")
+    if warm_start is None and asimov_pars is None and not expected_only:
+        return run_fit(data, pdf)
+
+    init_pars = warm_start.init_pars(patch.values, pdf) if warm_start else None
+    obsCLs, expCLs, best_pars = run_hypotest(data, pdf, init_pars, asimov_pars)
+    # expected-only fits have no best-fit parameters to start from
+    if warm_start and best_pars is not None:
+        warm_start.add(patch.values, pdf, best_pars)
+    if asimov_pars is not None and parallel.shared.get("check_asimov"):
+        compare_shared_asimov((obsCLs, expCLs), run_fit(data, pdf))
     return (obsCLs, expCLs)
 
 
+@timed("hypotest")
+def run_batched_hypotest(template, asimov_pars=None):
+    return batched_hypotest(
+        1.0,
+        template.data,
+        template.pdf,
+        qtilde=True,
+        asimov_pars=asimov_pars,
+        expected_only=parallel.shared.get("expected_only", False),
+    )
+
+
+def run_batch(template, patches):
+    n_points = template.set_signals(patches)
+    asimov_pars = shared_asimov_pars(template.data, template.pdf, template.ops)
+    obsCLs, expCLs = run_batched_hypotest(template, asimov_pars)
+    results = point_results(obsCLs, expCLs, n_points)
+    if asimov_pars is not None and parallel.shared.get("check_asimov"):
+        obsCLs, expCLs = run_batched_hypotest(template)
+        for result, unshared in zip(results, point_results(obsCLs, expCLs, n_points)):
+            compare_shared_asimov(result, unshared)
+    return results
+
+
+@timed("build_engine")
+def build_engine(template):
+    return SimplifiedEngine(template)
+
+
+@timed("set_signal")
+def engine_signals(engine, patches):
+    return engine.signals(patches)
+
+
+@timed("hypotest")
+def run_engine_hypotest(engine, signal):
+    return engine.hypotest(
+        1.0,
+        signal,
+        qtilde=True,
+        expected_only=parallel.shared.get("expected_only", False),
+    )
+
+
+def compare_engine(template, patches, results):
+    """
+    Run pyhf on every patch and fail if any CLs value of the simplified engine
+    differs by more than ``engine_tolerance``.
+    """
+    mismatches = []
+    for patch, result in zip(patches, results):
+        difference = cls_difference(result, run_fit(*set_signal(template, patch)))
+        if difference > engine_tolerance:
+            mismatches.append(f"{patch.name} ({difference:.2g})")
+    if mismatches:
+        raise RuntimeError(
+            f"CLs of the simplified engine differ from pyhf for {', '.join(mismatches)}"
+        )
+
+
+def run_engine(engine, patches):
+    obsCLs, expCLs = run_engine_hypotest(engine, engine_signals(engine, patches))
+    results = point_results(obsCLs, expCLs, len(patches))
+    if parallel.shared.get("check_engine"):
+        compare_engine(parallel.shared["template"], patches, results)
+    return results
+
+
+def run_signal_scans(spec, template, patches):
+    """
+    Upper limits on mu and CLs curves of ``patches``, evaluated the same way
+    as their CLs values.
+    """
+    expected_only = parallel.shared.get("expected_only", False)
+    scans = dict(
+        limits=parallel.shared.get("upper_limits", False),
+        curves=parallel.shared.get("cls_curves", False),
+        observed=not expected_only,
+        grid=parallel.shared.get("curve_grid"),
+    )
+    if parallel.shared.get("engine"):
+        engine = parallel.shared["engine"]
+        evaluate, mu_max = engine_evaluator(
+            engine, engine.signals(patches), expected_only=expected_only
+        )
+        return signal_scans(evaluate, len(patches), mu_max, **scans)
+    if template and template.batch_size:
+        asimov_pars = shared_asimov_pars(template.data, template.pdf, template.ops)
+        evaluate, mu_max = batched_evaluator(
+            template, patches, asimov_pars=asimov_pars, expected_only=expected_only
+        )
+        return signal_scans(evaluate, len(patches), mu_max, **scans)
+    extras = []
+    for patch in patches:
+        data, pdf = load_model(spec, patch, template=template)
+        asimov_pars = shared_asimov_pars(data, pdf, signal_ops(patch.patch))
+        evaluate, mu_max = model_evaluator(
+            data, pdf, asimov_pars=asimov_pars, expected_only=expected_only
+        )
+        extras += signal_scans(evaluate, 1, mu_max, **scans)
+    return extras
+
+
+def point_name(group, simplified, name):
+    return f"{'simplified_' if simplified else ''}{group}_{name}"
+
+
+@timed("write_result")
+def write_result(store, group, simplified, name, result, tier=None):
+    if tier is not None:
+        result = {**result, "tier": tier}
+    store.append(point_name(group, simplified, name), result)
+
+
+def in_band(result, low, high, bands=False):
+    """
+    Return True if the observed or nominal expected CLs (or, with ``bands``,
+    the expected CLs at +-1 sigma) is in [low, high].
+    """
+    return any(low <= value <= high for value in cls_values(result, bands=bands))
+
+
+def process_patches(entries):
+    """
+    Run one work item of the process pool, either a single patch or a batch of
+    patches, and return the results with the stage timings of this item.
+    """
+    with profiler.point(*(entry.name for entry in entries)) as record:
+        with stage("parse"):
+            patches = [parallel.shared["patchset"].load(entry) for entry in entries]
+        template = parallel.shared["template"]
+        if parallel.shared.get("engine"):
+            results = run_engine(parallel.shared["engine"], patches)
+        elif template and template.batch_size:
+            results = run_batch(template, patches)
+        else:
+            results = [
+                run_single_point(
+                    parallel.shared["spec"],
+                    patch,
+                    template=template,
+                    warm_start=parallel.shared["warm_start"],
+                )
+                for patch in patches
+            ]
+        extras = [{}] * len(patches)
+        if parallel.shared.get("upper_limits") or parallel.shared.get("cls_curves"):
+            extras = run_signal_scans(parallel.shared["spec"], template, patches)
+    return [(*result, extra) for result, extra in zip(results, extras)], record
+
+
+def scan(
+    group,
+    simplified,
+    likelihood,
+    patchset,
+    prune,
+    backend,
+    optimizer,
+    benchmark,
+    template,
+    jobs,
+    batch_size,
+    cache,
+    warm_start,
+    inplace_patches,
+    verify_patches,
+    validate_patches,
+    shared_asimov,
+    check_shared_asimov,
+    engine,
+    check_engine,
+    interim_every,
+    interim_seconds,
+    interim_command,
+    boundary_first,
+    coarse_fraction,
+    contour_margin,
+    contour_bands,
+    upper_limits,
+    cls_curves,
+    curve_range,
+    curve_points,
+    expected_only,
+    cost_order,
+    model_cache,
+    tune_points,
+    only=None,
+    tier=None,
+):
+    """
+    Run all patches of a patchset, or only those named in ``only``, and store
+    their results, marked with ``tier`` if given. Returns a dict of patch name
+    to result of all points that were run, taken from the cache or bounded.
+    """
+    bkgOnly = likelihood if not simplified else "simplified_" + likelihood
+    patchset = patchset if not simplified else "simplified_" + patchset
+
+    spec_path = pathlib.Path(f"./analyses/{group}/likelihoods/{bkgOnly}")
+    with stage("parse"):
+        spec = json.load(open(spec_path, "r"))
+
+    # only the index of the patchset is read here, patches are parsed on demand
+    with stage("index_patchset"):
+        patchset = PatchsetIndex(
+            pathlib.Path(f"./analyses/{group}/likelihoods/{patchset}")
+        )
+
+    # patches add samples and modifiers roughly in proportion to their size
+    base_size = model_size(spec)
+    spec_length = spec_path.stat().st_size
+
+    def patch_size(entry):
+        return base_size * (1.0 + entry.length / spec_length)
+
+    use_template = template or batch_size or engine == "simplified"
+    ops = template_ops(patchset) if use_template else None
+    if use_template and ops is None:
+        click.echo(
+            "Patches differ in more than the signal rates, running point by point."
+        )
+    if engine == "simplified" and not is_simplified(spec, ops):
+        click.echo("Not a simplified likelihood, using the pyhf engine.")
+        engine = "pyhf"
+
+    if backend == "auto":
+        if engine == "simplified":
+            # the engine does not use the backend
+            backend = "numpy"
+        else:
+            backend, optimizer = tune_backend(
+                group, spec, patchset, optimizer, tune_points
+            )
+        pyhf.set_backend(backend, optimizer)
+
+    if ops is not None and not swappable_rates():
+        click.echo(
+            f"Signal rates cannot be swapped with the {backend} backend of pyhf {pyhf.__version__}, running point by point."
+        )
+        ops = None
+        if engine == "simplified":
+            # the engine is built from the template
+            engine = "pyhf"
+
+    signal_template = None
+    simplified_engine = None
+    if ops is not None:
+        # the engine takes its bins and parameters from an unbatched template
+        signal_template = build_template(
+            spec,
+            ops,
+            batch_size=batch_size if engine == "pyhf" else None,
+            model_cache=ModelCache(model_cache_path(group)) if model_cache else None,
+        )
+    if engine == "simplified":
+        simplified_engine = build_engine(signal_template)
+
+    result_store = ResultStore(store_path(group))
+    result_cache = ResultCache(cache_path(group)) if cache else None
+    settings = {
+        "bkgonly": pyhf.utils.digest(spec),
+        "backend": backend,
+        "optimizer": optimizer,
+        "modifier_settings": modifier_settings,
+        "prune": list(prune),
+        "batched": bool(signal_template and batch_size),
+    }
+    # keeps the keys of results computed before the engine could be chosen
+    if engine != "pyhf":
+        settings["engine"] = engine
+    if upper_limits:
+        settings["upper_limits"] = True
+    if cls_curves:
+        settings["cls_curves"] = {"range": list(curve_range), "points": curve_points}
+    if expected_only:
+        settings["expected_only"] = True
+    keys = {}
+    scan_results = {}
+
+    # patches without any signal have no POI to test
+    patches = []
+    cached = []
+    for entry in patchset.entries:
+        if only is not None and entry.name not in only:
+            continue
+        if signal_template and not entry.n_ops:
+            print(f"No signal in patch {entry.name}, skipping.")
+            continue
+        if result_cache is not None:
+            key = ResultCache.key(patch=entry.digest, **settings)
+            if key in result_cache:
+                result = scan_results[entry.name] = result_cache.get(key)
+                write_result(result_store, group, simplified, entry.name, result, tier)
+                cached.append((entry, result))
+                continue
+            keys[entry.name] = key
+        patches.append(entry)
+
+    if result_cache is not None:
+        click.echo(
+            f"{len(patchset) - len(patches)} point(s) cached or skipped, {len(patches)} to run."
+        )
+
+    interim = None
+    if interim_every or interim_seconds:
+        wildcard = harvest.harvest_wildcard(f"{group}_*.json", simplified)
+        interim = InterimHarvest(
+            lambda: harvest.harvest_records(
+                harvest.matching_records(
+                    map(result_store.get, sorted(result_store.written)), wildcard
+                )
+            ),
+            harvest.write_harvest,
+            harvest.harvest_path(group, simplified, suffix="_interim"),
+            every=interim_every,
+            seconds=interim_seconds,
+            command=interim_command,
+        )
+
+    scheduler = None
+    if boundary_first:
+        scheduler = BoundaryScheduler(
+            patches,
+            known=cached,
+            coarse_fraction=coarse_fraction,
+            level=contour_level,
+            margin=contour_margin,
+            bands=contour_bands,
+        )
+    rounds = scheduler.rounds() if scheduler else [patches]
+
+    # the engine fits its points all at once, their times say nothing about them
+    cost_model = CostModel(timings_path(group)) if not simplified_engine else None
+    cost = None
+    if cost_model is not None and cost_order and jobs > 1:
+
+        def cost(points):
+            return sum(
+                cost_model.estimate(
+                    point_name(group, simplified, entry.name), patch_size(entry)
+                )
+                for entry in points
+            )
+
+    shared_warm_start = WarmStart() if warm_start else None
+    failed = []
+    for patches in rounds:
+        if warm_start:
+            patches = mass_order(patches)
+
+        if simplified_engine:
+            # all points at once, or split evenly among the workers
+            chunk = batch_size or max(1, math.ceil(len(patches) / jobs))
+        else:
+            chunk = batch_size if signal_template and batch_size else 1
+        items = [
+            patches[start : start + chunk] for start in range(0, len(patches), chunk)
+        ]
+
+        for points, result, error in parallel.run_parallel(
+            process_patches,
+            items,
+            jobs=jobs,
+            backend=backend,
+            optimizer=optimizer,
+            cost=cost,
+            spec=spec,
+            patchset=patchset,
+            template=signal_template,
+            warm_start=shared_warm_start,
+            inplace=inplace_patches,
+            verify=verify_patches,
+            validate=validate_patches,
+            validated=False,
+            shared_asimov=shared_asimov,
+            check_asimov=check_shared_asimov,
+            background_fit=None,
+            engine=simplified_engine,
+            check_engine=check_engine,
+            upper_limits=upper_limits,
+            cls_curves=cls_curves,
+            curve_grid=curve_grid(*curve_range, curve_points),
+            expected_only=expected_only,
+        ):
+            if error:
+                for patch in points:
+                    click.echo(f"Failed {patch.name}:\n{error}", err=True)
+                    failed.append(patch.name)
+                continue
+
+            results, record = result
+            profiler.add(record)
+            if cost_model is not None:
+                for patch in points:
+                    cost_model.add(
+                        point_name(group, simplified, patch.name),
+                        record["total"] / len(points),
+                        patch_size(patch),
+                    )
+            for patch, (obsCLs, expCLs, extra) in zip(points, results):
+                # click.echo({
+                #             "CLs_exp": [float(i.tolist()) for i in expCLs],
+                #             "CLs_obs": obsCLs.tolist()
+                #         })
+                point_result = scan_results[patch.name] = cls_result(obsCLs, expCLs)
+                point_result.update(extra)
+                write_result(
+                    result_store, group, simplified, patch.name, point_result, tier
+                )
+                if result_cache is not None:
+                    result_cache.put(keys[patch.name], point_result)
+                if scheduler:
+                    scheduler.add(patch, point_result)
+            if interim:
+                interim.completed(len(points))
+
+            if benchmark:
+                print_timings(record)
+        sync_records()
+
+    if scheduler:
+        # bounded results are not cached, they are redone with their neighbours
+        bounded = scheduler.bounded()
+        for patch, point_result in bounded:
+            scan_results[patch.name] = point_result
+            write_result(
+                result_store, group, simplified, patch.name, point_result, tier
+            )
+        click.echo(
+            f"{len(scheduler.scheduled)} point(s) fitted, {len(bounded)} far from the contour bounded by their neighbours."
+        )
+        if interim:
+            interim.completed(len(bounded))
+
+    if interim:
+        interim.close()
+
+    if failed:
+        click.echo(f"{len(failed)} point(s) failed: {' '.join(failed)}", err=True)
+    return scan_results
+
+
 @click.command()
 @click.option(
     "--group",
@@ -133,10 +748,190 @@ def run_single_point(spec, patch):
 )
 @click.option("--likelihood", default="BkgOnly.json")
 @click.option("--patchset", default="patchset.json")
-@click.option("--backend", default="numpy")
+@click.option(
+    "--backend",
+    default="numpy",
+    help="pyhf backend, or auto to pick the fastest installed one that agrees with numpy",
+)
 @click.option("--optimizer", default=None)
 @click.option("--skip-to", default=None)
 @click.option("--benchmark/--no-benchmark", default=False)
+@click.option(
+    "--template/--no-template",
+    default=True,
+    help="Build the model once and only swap signal rates if the patches allow it",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes",
+)
+@click.option(
+    "--batch-size",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Evaluate this many patches at once in a batched model",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Skip points whose result is already in the cache of the group",
+)
+@click.option(
+    "--warm-start/--no-warm-start",
+    default=False,
+    help="Run points in mass order and seed each fit with the best-fit parameters of the nearest completed point (only with --jobs 1)",
+)
+@click.option(
+    "--inplace-patches/--no-inplace-patches",
+    default=True,
+    help="Apply patches directly to the shared background-only spec instead of a copy",
+)
+@click.option(
+    "--verify-patches/--no-verify-patches",
+    default=False,
+    help="Check in-place patching against jsonpatch and the restored spec",
+)
+@click.option(
+    "--validate-patches/--no-validate-patches",
+    default=True,
+    help="Check the first in-place patched spec of every worker against the workspace schema and jsonpatch",
+)
+@click.option(
+    "--trace",
+    default=None,
+    type=click.Path(dir_okay=False),
+    help="Write per-point stage timings, histograms and profiles to this JSON file",
+)
+@click.option(
+    "--profile-slowest",
+    default=0,
+    type=click.IntRange(min=0),
+    help="Run every point under cProfile and keep the profiles of the N slowest",
+)
+@click.option(
+    "--shared-asimov/--no-shared-asimov",
+    default=False,
+    help="Fit at mu=0 and build the Asimov dataset only once if the signal allows it, skipping the unconditional fit to it (not exact for weak signals)",
+)
+@click.option(
+    "--check-shared-asimov/--no-check-shared-asimov",
+    default=False,
+    help="Also run every point without the shared Asimov dataset and compare",
+)
+@click.option(
+    "--engine",
+    default="pyhf",
+    type=click.Choice(["pyhf", "simplified"]),
+    help="Evaluate simplified likelihoods with the vectorized NumPy engine instead of pyhf",
+)
+@click.option(
+    "--check-engine/--no-check-engine",
+    default=False,
+    help="Also run every point of the simplified engine through pyhf and compare",
+)
+@click.option(
+    "--interim-every",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Write an interim harvest every N completed points",
+)
+@click.option(
+    "--interim-seconds",
+    default=None,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Write an interim harvest every T seconds",
+)
+@click.option(
+    "--interim-command",
+    default=None,
+    help="Run this in the background after every interim harvest, {harvest} is replaced by its path",
+)
+@click.option(
+    "--boundary-first/--no-boundary-first",
+    default=False,
+    help="Fit a coarse subset of points first and then only those near the CLs contour",
+)
+@click.option(
+    "--coarse-fraction",
+    default=0.25,
+    type=click.FloatRange(min=0.0, max=1.0),
+    help="Fraction of points fitted in the first, coarse pass of --boundary-first",
+)
+@click.option(
+    "--contour-margin",
+    default=1.0,
+    type=click.FloatRange(min=1.0),
+    help="Fit points whose neighbours straddle the contour level, widened by this factor",
+)
+@click.option(
+    "--contour-bands/--no-contour-bands",
+    default=False,
+    help="Also refine the +-1 sigma expected contours with --boundary-first, not only the observed and nominal expected ones",
+)
+@click.option(
+    "--tiered/--no-tiered",
+    default=False,
+    help="Run the simplified likelihood first and the full likelihood only for points with CLs in --tier-band",
+)
+@click.option(
+    "--tier-band",
+    nargs=2,
+    default=(0.02, 0.125),
+    type=float,
+    help="Points whose observed or nominal expected CLs is within this range, by default a factor 2.5 around 0.05, are run with the full likelihood",
+)
+@click.option(
+    "--tier-bands/--no-tier-bands",
+    default=False,
+    help="Also select points on the expected CLs at +-1 sigma with --tiered",
+)
+@click.option(
+    "--upper-limits/--no-upper-limits",
+    default=False,
+    help="Also compute the observed and expected upper limits on mu of every point",
+)
+@click.option(
+    "--cls-curves/--no-cls-curves",
+    default=False,
+    help="Also store the CLs of every point as a function of mu, for rescale.py",
+)
+@click.option(
+    "--curve-range",
+    nargs=2,
+    default=curve_range,
+    type=click.FloatRange(min=0.0, min_open=True),
+    help="Range of mu of the CLs curves, i.e. of the signal scale factors rescale.py can apply",
+)
+@click.option(
+    "--curve-points",
+    default=curve_points,
+    type=click.IntRange(min=2),
+    help="Number of log-spaced values of mu of the CLs curves",
+)
+@click.option(
+    "--expected-only/--no-expected-only",
+    default=False,
+    help="Only compute the expected CLs band, skipping all fits to the observed data but the one at mu=0",
+)
+@click.option(
+    "--cost-order/--no-cost-order",
+    default=True,
+    help="With several jobs, run the points expected to take longest (from model size and earlier timings) first",
+)
+@click.option(
+    "--model-cache/--no-model-cache",
+    default=True,
+    help="Store the template model on disk and reuse it in later runs",
+)
+@click.option(
+    "--tune-points",
+    default=3,
+    type=click.IntRange(min=1),
+    help="Number of points timed with every backend and optimizer for --backend auto",
+)
 def main(
     group,
     simplified,
@@ -150,49 +945,119 @@ def main(
     optimizer,
     skip_to,
     benchmark,
+    template,
+    jobs,
+    batch_size,
+    cache,
+    warm_start,
+    inplace_patches,
+    verify_patches,
+    validate_patches,
+    trace,
+    profile_slowest,
+    shared_asimov,
+    check_shared_asimov,
+    engine,
+    check_engine,
+    interim_every,
+    interim_seconds,
+    interim_command,
+    boundary_first,
+    coarse_fraction,
+    contour_margin,
+    contour_bands,
+    tiered,
+    tier_band,
+    tier_bands,
+    upper_limits,
+    cls_curves,
+    curve_range,
+    curve_points,
+    expected_only,
+    cost_order,
+    model_cache,
+    tune_points,
 ):
 
-    pyhf.set_backend(backend, optimizer)
+    if warm_start and jobs > 1:
+        # every worker would only see the points it completed itself
+        raise click.UsageError("--warm-start needs --jobs 1")
+    if curve_range[0] >= curve_range[1]:
+        raise click.BadParameter("must be increasing", param_hint="--curve-range")
 
-    bkgOnly = likelihood if not simplified else "simplified_" + likelihood
-    patchset = patchset if not simplified else "simplified_" + patchset
+    # with auto, every scan sets the backend tuned for its likelihood
+    if backend != "auto":
+        pyhf.set_backend(backend, optimizer)
+    profiler.profile_slowest = profile_slowest
 
-    spec = json.load(
-        open(pathlib.Path(f"./analyses/{group}/likelihoods/{bkgOnly}"), "r")
+    options = dict(
+        group=group,
+        likelihood=likelihood,
+        patchset=patchset,
+        prune=(prune_channel, prune_modifier, prune_modifier_type, prune_sample),
+        backend=backend,
+        optimizer=optimizer,
+        benchmark=benchmark,
+        template=template,
+        jobs=jobs,
+        batch_size=batch_size,
+        cache=cache,
+        warm_start=warm_start,
+        inplace_patches=inplace_patches,
+        verify_patches=verify_patches,
+        validate_patches=validate_patches,
+        shared_asimov=shared_asimov,
+        check_shared_asimov=check_shared_asimov,
+        engine=engine,
+        check_engine=check_engine,
+        interim_every=interim_every,
+        interim_seconds=interim_seconds,
+        interim_command=interim_command,
+        boundary_first=boundary_first,
+        coarse_fraction=coarse_fraction,
+        contour_margin=contour_margin,
+        contour_bands=contour_bands,
+        upper_limits=upper_limits,
+        cls_curves=cls_curves,
+        curve_range=curve_range,
+        curve_points=curve_points,
+        expected_only=expected_only,
+        cost_order=cost_order,
+        model_cache=model_cache,
+        tune_points=tune_points,
     )
 
-    patchset = pyhf.PatchSet(
-        json.load(open(pathlib.Path(f"./analyses/{group}/likelihoods/{patchset}"), "r"))
-    )
+    if not tiered:
+        scan(simplified=simplified, **options)
+    else:
+        simplified_results = scan(simplified=True, **options)
+        selected = {
+            name
+            for name, result in simplified_results.items()
+            if in_band(result, *tier_band, bands=tier_bands)
+        }
+        click.echo(
+            f"{len(selected)} of {len(simplified_results)} point(s) have CLs in {list(tier_band)}, running the full likelihood for them."
+        )
+        options.update(engine="pyhf", boundary_first=False)
+        full_results = scan(simplified=False, only=selected, tier="full", **options)
 
-    for patch in patchset.patches:
-        try:
-            obsCLs, expCLs = run_single_point(spec, patch)
-
-            # click.echo({
-            #             "CLs_exp": [float(i.tolist()) for i in expCLs],
-            #             "CLs_obs": obsCLs.tolist()
-            #         })
-            with open(
-                pathlib.Path(
-                    f"analyses/{group}/results/{'simplified_' if simplified else ''}{group}_{patch.name}.json"
-                ),
-                "w",
-            ) as fp:
-                json.dump(
-                    {
-                        "CLs_exp": [float(i.tolist()) for i in expCLs],
-                        "CLs_obs": obsCLs.tolist(),
-                    },
-                    fp,
+        # all other points keep the result of the simplified likelihood
+        result_store = ResultStore(store_path(group))
+        for name, result in simplified_results.items():
+            if name in full_results:
+                continue
+            if name in selected:
+                click.echo(
+                    f"No full likelihood result for {name}, keeping the simplified one.",
+                    err=True,
                 )
+            write_result(result_store, group, False, name, result, "simplified")
 
-            if benchmark:
-                print(*total_time, sep=" ")
-            total_time.clear()
-
-        except Exception as e:
-            print(e)
+    if benchmark:
+        profiler.print_summary()
+    if trace:
+        profiler.write_trace(trace)
 
 
 if __name__ == "__main__":
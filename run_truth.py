@@ -5,16 +5,22 @@ import collections
 import csv
 import json
 import re
-import math
 import pathlib
 import jsonpatch
-import pprint
 
+import numpy as np
 import pyhf
 
 pyhf.set_backend("numpy")
 
-from xsecDB import CrossSectionDB
+from helpers.xsecDB import CrossSectionDB
+from helpers import parallel
+from helpers.inference import hypotest
+from helpers.resultCache import ResultCache, cache_path, cls_result
+from helpers.resultStore import ResultStore, store_path
+from helpers.signalTemplate import swappable_rates
+from helpers.truthTemplate import TruthTemplate
+from helpers.truthYields import truth_cache_path, truth_yields
 
 xsecDB = CrossSectionDB()
 
@@ -23,17 +29,80 @@ dsid_pattern = re.compile("(\d{6}?)")
 point_pattern = re.compile("(\d+(?:p[05])_\d+(?:p[05])){1}")
 
 
+modifier_settings = {
+    "normsys": {"interpcode": "code4"},
+    "histosys": {"interpcode": "code4p"},
+}
+
+
 def string_to_float(string):
     return float(string.replace("p", "."))
 
 
+def point_patches(patchDef, events):
+    patches = []
+    for srName in patchDef["eff"]:
+        path = patchDef["jsonpath"][srName]
+        expected = float(events[srName][0])
+        # expected *= float(patchDef['eff'][srName])
+
+        patches.append({"op": "replace", "path": path, "value": expected})
+    return patches
+
+
+def point_model(spec, patchDef, events, prune):
+    patches = point_patches(patchDef, events)
+
+    patched_spec = jsonpatch.apply_patch(spec, patches)
+
+    ws = pyhf.Workspace(patched_spec)
+    ws = ws.prune(
+        modifiers=prune["modifiers"],
+        modifier_types=prune["modifier_types"],
+        samples=prune["samples"],
+        channels=prune["channels"],
+    )
+
+    pdf = ws.model(modifier_settings=modifier_settings)
+    return ws.data(pdf), pdf
+
+
+def run_point(point):
+    patchDef = parallel.shared["patchDef"]
+    events = parallel.shared["expectedEvents"][point]
+    template = parallel.shared["template"]
+
+    if template is not None:
+        template.set_yields(
+            [patch["value"] for patch in point_patches(patchDef, events)]
+        )
+        data, pdf = template.data, template.pdf
+    else:
+        data, pdf = point_model(
+            parallel.shared["spec"], patchDef, events, parallel.shared["prune"]
+        )
+
+    if parallel.shared["expected_only"]:
+        obsCLs, expCLs, _ = hypotest(1.0, data, pdf, qtilde=True, expected_only=True)
+        return obsCLs, expCLs
+    return pyhf.infer.hypotest(1.0, data, pdf, qtilde=True, return_expected_set=True)
+
+
+def write_result(store, group, simplified, point, result):
+    store.append(f"truth_{'simplified_' if simplified else ''}{group}_{point}", result)
+
+
 @click.command()
 @click.option(
     "--group",
     default="1Lbb",
     type=click.Choice(["1Lbb", "2L0J", "compressed", "3Loffshell"]),
 )
-@click.option("--backend", default="pytorch")
+@click.option(
+    "--backend",
+    default="numpy",
+    help="pyhf backend, --template only works with numpy",
+)
 @click.option(
     "--prune-channel",
     default=[],
@@ -64,6 +133,28 @@ def string_to_float(string):
 @click.option("--patchname", default=None)
 @click.option("--lumi", default=139000)
 @click.option("--include", default=None)
+@click.option(
+    "--jobs",
+    "-j",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of worker processes",
+)
+@click.option(
+    "--cache/--no-cache",
+    default=True,
+    help="Skip points whose result is already in the cache of the group",
+)
+@click.option(
+    "--expected-only/--no-expected-only",
+    default=False,
+    help="Only compute the expected CLs band, skipping all fits to the observed data but the one at mu=0",
+)
+@click.option(
+    "--template/--no-template",
+    default=True,
+    help="Build the pruned model once and only replace the signal yields per point (numpy backend only)",
+)
 def main(
     group,
     backend,
@@ -77,6 +168,10 @@ def main(
     patchname,
     lumi,
     include,
+    jobs,
+    cache,
+    expected_only,
+    template,
 ):
 
     pyhf.set_backend(backend, optimizer)
@@ -118,89 +213,124 @@ def main(
     wildcard = "*C1*N2*.txt" if not include else include
     filenames = pathlib.Path(f"./analyses/{group}/truth/").glob(wildcard)
 
-    expectedEvents = collections.defaultdict(
-        lambda: collections.defaultdict(lambda: None)
-    )
-
+    filenames = sorted(filenames)
+    points, dsids = [], []
     for filename in filenames:
         point_match = point_pattern.search(filename.name)
         assert point_match
+        points.append(point_match[0])
 
         mass_match = mass_pattern.search(filename.name)
         assert mass_match
-        masses = string_to_float(mass_match.group(1)), string_to_float(
-            mass_match.group(2)
-        )
 
         dsid_match = dsid_pattern.search(filename.name)
         assert dsid_match
-        dsid = string_to_float(dsid_match.group(1))
-        xsec = xsecDB.xsecTimesEff(dsid)
-
-        # print(filename)
-
-        with open(filename) as file:
-            next(file)  # skip header
-            for l in file:
-                l = l.strip().split(",")
-                events = float(lumi) * xsec * float(l[2])
-                statError = float(lumi) * xsec * float(l[3])
-                # print(expectedEvents[point_match[0]])
-                if expectedEvents[point_match[0]][l[0]]:
-                    events += expectedEvents[point_match[0]][l[0]][0]
-                    statError = math.sqrt(
-                        statError ** 2 + expectedEvents[point_match[0]][l[0]][1] ** 2
-                    )
-                expectedEvents[point_match[0]][l[0]] = (events, statError)
-
-    pprint.pprint(expectedEvents["700p0_150p0"])
-
-    for point, events in expectedEvents.items():
-        patches = []
-        handled_channels = []
-        for srName in patchDef["eff"]:
-            path = patchDef["jsonpath"][srName]
-            expected = float(events[srName][0])
-            # expected *= float(patchDef['eff'][srName])
-
-            patches.append({"op": "replace", "path": path, "value": expected})
-
-        patched_spec = jsonpatch.apply_patch(spec, patches)
-
-        ws = pyhf.Workspace(patched_spec)
-        ws = ws.prune(
-            modifiers=prune_modifier,
-            modifier_types=prune_modifier_type,
-            samples=prune_sample,
-            channels=prune_channel,
-        )
+        dsids.append(int(dsid_match.group(1)))
 
-        pdf = ws.model(
-            modifier_settings={
-                "normsys": {"interpcode": "code4"},
-                "histosys": {"interpcode": "code4p"},
-            }
+    xsecs, missing = xsecDB.xsecsTimesEff(dsids)
+    if missing.any():
+        raise click.ClickException(
+            "No cross-section for DSID(s) "
+            + " ".join(str(dsid) for dsid in np.asarray(dsids)[missing])
         )
 
-        print("Running " + point)
+    yields = truth_yields(
+        filenames,
+        points,
+        dsids,
+        dict(zip(dsids, xsecs)),
+        cache=truth_cache_path(group) if cache else None,
+    )
+    expectedEvents = collections.defaultdict(
+        lambda: collections.defaultdict(lambda: None)
+    )
+    for point, sr, events, statError in zip(
+        yields["point"],
+        yields["sr"],
+        float(lumi) * yields["events"].to_numpy(),
+        float(lumi) * yields["error"].to_numpy(),
+    ):
+        expectedEvents[point][sr] = (float(events), float(statError))
 
-        obsCLs, expCLs = pyhf.infer.hypotest(
-            1.0, ws.data(pdf), pdf, qtilde=True, return_expected_set=True
+    prune = {
+        "modifiers": prune_modifier,
+        "modifier_types": prune_modifier_type,
+        "samples": prune_sample,
+        "channels": prune_channel,
+    }
+
+    points = list(dict.fromkeys(yields["point"]))
+    result_store = ResultStore(store_path(group))
+    result_cache = ResultCache(cache_path(group)) if cache else None
+    keys = {}
+    if result_cache is not None:
+        settings = {
+            "bkgonly": pyhf.utils.digest(spec),
+            "backend": backend,
+            "optimizer": optimizer,
+            "modifier_settings": modifier_settings,
+            "prune": prune,
+        }
+        if expected_only:
+            settings["expected_only"] = True
+        for point in list(points):
+            key = ResultCache.key(
+                patch=pyhf.utils.digest(point_patches(patchDef, expectedEvents[point])),
+                **settings,
+            )
+            if key in result_cache:
+                write_result(
+                    result_store, group, simplified, point, result_cache.get(key)
+                )
+                points.remove(point)
+                continue
+            keys[point] = key
+        click.echo(f"{len(points)} point(s) to run, the others are cached.")
+
+    truth_template = None
+    if template and points:
+        truth_template = TruthTemplate.compile(
+            spec,
+            [patchDef["jsonpath"][srName] for srName in patchDef["eff"]],
+            prune,
+            modifier_settings,
         )
-        with open(
-            pathlib.Path(
-                f"analyses/{group}/results/truth_{'simplified_' if simplified else ''}{group}_{point}.json"
-            ),
-            "w",
-        ) as fp:
-            json.dump(
-                {
-                    "CLs_exp": [float(i.tolist()) for i in expCLs],
-                    "CLs_obs": obsCLs.tolist(),
-                },
-                fp,
+        if truth_template is None:
+            click.echo(
+                "The patch replaces more than scaled signal rates, building a model per point."
+                if swappable_rates()
+                else f"Signal yields cannot be replaced with the {backend} backend of pyhf {pyhf.__version__}, building a model per point."
             )
 
+    failed = []
+    for point, result, error in parallel.run_parallel(
+        run_point,
+        points,
+        jobs=jobs,
+        backend=backend,
+        optimizer=optimizer,
+        spec=spec,
+        patchDef=patchDef,
+        expectedEvents=expectedEvents,
+        prune=prune,
+        expected_only=expected_only,
+        template=truth_template,
+    ):
+        click.echo(point)
+
+        if error:
+            click.echo(f"Failed {point}:\n{error}", err=True)
+            failed.append(point)
+            continue
+
+        point_result = cls_result(*result)
+        write_result(result_store, group, simplified, point, point_result)
+        if result_cache is not None:
+            result_cache.put(keys[point], point_result)
+
+    if failed:
+        click.echo(f"{len(failed)} point(s) failed: {' '.join(failed)}", err=True)
+
 
 if __name__ == "__main__":
     main()
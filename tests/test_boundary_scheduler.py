@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from helpers.boundaryScheduler import BoundaryScheduler
+
+
+def grid_point(x, y):
+    return SimpleNamespace(name=f"{x}_{y}", values=[float(x), float(y)])
+
+
+def point_result(entry):
+    # CLs falls with the first mass and crosses 0.05 at x = 15; the +-2 sigma
+    # band is wide enough to straddle 0.05 everywhere
+    cls = float(np.exp(-0.2 * entry.values[0]))
+    return {"CLs_obs": cls, "CLs_exp": [0.001, cls / 2, cls, cls * 2, 0.9]}
+
+
+def run_scheduler(scheduler):
+    """
+    Names of the points fitted in the coarse round and in all rounds.
+    """
+    rounds = []
+    for batch in scheduler.rounds():
+        rounds.append({entry.name for entry in batch})
+        for entry in batch:
+            scheduler.add(entry, point_result(entry))
+    return rounds[0], set().union(*rounds)
+
+
+def test_interior_points_are_bounded():
+    entries = [grid_point(x, y) for x in range(30) for y in range(6)]
+    scheduler = BoundaryScheduler(entries, coarse_fraction=0.25)
+    coarse, fitted = run_scheduler(scheduler)
+
+    bounded = {entry.name: result for entry, result in scheduler.bounded()}
+    assert len(bounded) + len(fitted) == len(entries)
+    # far from the contour only coarse points are fitted, even though the
+    # +-2 sigma band straddles the contour level everywhere
+    interior = [entry for entry in entries if abs(entry.values[0] - 15) > 6]
+    assert {entry.name for entry in interior} & fitted <= coarse
+    assert len(bounded) >= len(interior) - len(coarse)
+    # bounds are on the correct side of the contour
+    for entry in interior:
+        if entry.name in bounded:
+            excluded = point_result(entry)["CLs_obs"] < 0.05
+            assert (bounded[entry.name]["CLs_obs"] < 0.05) == excluded
+
+
+def test_bands_refine_more_points():
+    entries = [grid_point(x, y) for x in range(30) for y in range(6)]
+    _, nominal = run_scheduler(BoundaryScheduler(entries, coarse_fraction=0.25))
+    _, bands = run_scheduler(
+        BoundaryScheduler(entries, coarse_fraction=0.25, bands=True)
+    )
+    assert nominal < bands
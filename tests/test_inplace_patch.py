@@ -0,0 +1,49 @@
+import copy
+import json
+import pathlib
+
+import pyhf
+import pytest
+
+import run_patchset
+from helpers import parallel
+from helpers.patchsetIndex import PatchsetIndex
+
+likelihoods = pathlib.Path("analyses/3Loffshell/likelihoods")
+point = "3Lconfig_MLL_v2p2_CRs_WZ_250_230"
+
+
+@pytest.fixture
+def spec():
+    return json.load(open(likelihoods / "simplified_BkgOnly.json"))
+
+
+@pytest.fixture
+def patch():
+    return PatchsetIndex(likelihoods / "simplified_patchset.json")[point]
+
+
+@pytest.fixture(autouse=True)
+def inplace_validated():
+    pyhf.set_backend("numpy", "scipy")
+    parallel.shared.update(inplace=True, validate=True, validated=False)
+    yield
+    parallel.shared.clear()
+
+
+def test_first_patch_is_validated(spec, patch):
+    run_patchset.load_model(spec, patch)
+    assert parallel.shared["validated"]
+
+
+def test_malformed_patch_fails_validation(spec, patch):
+    # pyhf.Model only validates the channels, not the observations
+    malformed = copy.deepcopy(patch)
+    malformed.patch.append(
+        {"op": "replace", "path": "/observations/0/data", "value": ["1.0"]}
+    )
+    unpatched = pyhf.utils.digest(spec)
+
+    with pytest.raises(pyhf.exceptions.InvalidSpecification):
+        run_patchset.load_model(spec, malformed)
+    assert pyhf.utils.digest(spec) == unpatched
@@ -0,0 +1,22 @@
+from helpers import resultStore
+from helpers.resultStore import append_record, read_records, sync_records
+
+
+def test_records_are_readable_before_sync(tmp_path):
+    path = tmp_path / "results.jsonl"
+    append_record(path, {"name": "a"})
+    append_record(path, {"name": "b"})
+    # a single open file for all records until the batch is synced
+    assert list(resultStore._record_files) == [path]
+    assert [record["name"] for record in read_records(path)] == ["a", "b"]
+
+    sync_records()
+    assert not resultStore._record_files
+
+
+def test_cut_off_record_is_skipped(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"name": "a"}\n{"name": "b", "CLs')
+    append_record(path, {"name": "c"})
+    sync_records()
+    assert [record["name"] for record in read_records(path)] == ["a", "c"]
@@ -0,0 +1,88 @@
+import json
+import pathlib
+
+import pyhf
+import pytest
+
+import run_patchset
+from helpers import parallel
+from helpers.inference import background_fit, hypotest, pars_from_names
+from helpers.patchsetIndex import PatchsetIndex
+
+likelihoods = pathlib.Path("analyses/3Loffshell/likelihoods")
+# signals strong enough for the likelihood not to be flat in mu
+points = [
+    "3Lconfig_MLL_v2p2_CRs_C1N2_WZ_100_95_3L2MET75",
+    "3Lconfig_MLL_v2p2_CRs_WZ_250_230",
+    "3Lconfig_MLL_v2p2_CRs_WZ_350_270",
+]
+# weak signal, for which the shared Asimov dataset shifts the expected CLs by 0.03
+weak_point = "3Lconfig_MLL_v2p2_CRs_C1N2_WZ_200_197_3L2MET75"
+
+
+@pytest.fixture(scope="module")
+def spec():
+    return json.load(open(likelihoods / "simplified_BkgOnly.json"))
+
+
+@pytest.fixture(scope="module")
+def patchset():
+    return PatchsetIndex(likelihoods / "simplified_patchset.json")
+
+
+@pytest.fixture(autouse=True)
+def numpy_backend():
+    pyhf.set_backend("numpy", "scipy")
+    parallel.shared.update(inplace=True, background_fit=None)
+    yield
+    parallel.shared.clear()
+
+
+def test_shared_asimov_off_by_default():
+    shared_asimov = next(
+        param for param in run_patchset.main.params if param.name == "shared_asimov"
+    )
+    assert shared_asimov.default is False
+
+
+@pytest.mark.parametrize("point", points)
+def test_shared_matches_unshared(spec, patchset, point):
+    patch = patchset[point]
+    parallel.shared.update(shared_asimov=False)
+    unshared = run_patchset.run_single_point(spec, patch)
+
+    parallel.shared.update(shared_asimov=True, background_fit=None)
+    shared = run_patchset.run_single_point(spec, patch)
+    # the shared path ran and stored its fit at mu=0
+    assert parallel.shared["background_fit"] is not None
+    assert (
+        run_patchset.cls_difference(shared, unshared) <= run_patchset.asimov_tolerance
+    )
+
+
+@pytest.mark.parametrize("point", points)
+def test_hypotest_with_asimov_pars_matches_pyhf(spec, patchset, point):
+    data, pdf = run_patchset.build_model(
+        run_patchset.apply_patch(spec, patchset[point])
+    )
+    asimov_pars = pars_from_names(pdf, background_fit(data, pdf))
+
+    obsCLs, expCLs, _ = hypotest(1.0, data, pdf, asimov_pars=asimov_pars)
+    reference = pyhf.infer.hypotest(
+        1.0, data, pdf, qtilde=True, return_expected_set=True
+    )
+    assert (
+        run_patchset.cls_difference((obsCLs, expCLs), reference)
+        <= run_patchset.asimov_tolerance
+    )
+
+
+def test_check_fails_on_mismatch(spec, patchset):
+    parallel.shared.update(shared_asimov=True, check_asimov=True)
+    with pytest.raises(RuntimeError, match="shared Asimov dataset differ"):
+        run_patchset.run_single_point(spec, patchset[weak_point])
+
+
+def test_check_passes_on_agreement(spec, patchset):
+    parallel.shared.update(shared_asimov=True, check_asimov=True)
+    run_patchset.run_single_point(spec, patchset[points[0]])
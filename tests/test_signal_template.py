@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from helpers.signalTemplate import template_ops
+
+
+def signal_patch(rates, modifier):
+    return SimpleNamespace(
+        patch=[
+            {
+                "op": "add",
+                "path": "/channels/0/samples/5",
+                "value": {
+                    "name": "signal",
+                    "data": rates,
+                    "modifiers": [
+                        {"name": "mu_SIG", "type": "normfactor", "data": None},
+                        modifier,
+                    ],
+                },
+            }
+        ]
+    )
+
+
+def test_scaling_modifiers_use_template():
+    normsys = {"name": "theory", "type": "normsys", "data": {"hi": 1.1, "lo": 0.9}}
+    patches = [signal_patch([1.0, 2.0], normsys), signal_patch([3.0, 4.0], normsys)]
+
+    ops = template_ops(patches)
+    assert ops is not None
+    assert ops[0]["value"]["data"] == [0.0, 0.0]
+
+
+def test_histosys_falls_back():
+    # histosys deltas are computed from the nominal rates when the model is built
+    histosys = {
+        "name": "shape",
+        "type": "histosys",
+        "data": {"hi_data": [1.5, 2.5], "lo_data": [0.5, 1.5]},
+    }
+    patches = [signal_patch([1.0, 2.0], histosys), signal_patch([1.0, 2.0], histosys)]
+
+    assert template_ops(patches) is None